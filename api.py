@@ -0,0 +1,140 @@
+# HTTP endpoints, imported by main.py once sampling is running
+import uasyncio
+import log
+import webserver
+import export
+import metrics
+import config
+
+# Set by init(), before app.run()
+solar_manager = None
+wifi_tracker = None
+log_sink = None
+boot_timings = {}
+
+def init(manager, wifi, sink, timings):
+    global solar_manager, wifi_tracker, log_sink, boot_timings
+    solar_manager = manager
+    wifi_tracker = wifi
+    log_sink = sink
+    boot_timings = timings
+
+app = webserver.Server(static_path='/static/',
+                       auth_token=config.AUTH_TOKEN,
+                       pre_request_hook=lambda: uasyncio.create_task(wifi_tracker.blink()))
+
+@app.json()
+def devicesread(verb, _):
+    return solar_manager.latest_read()
+
+def state_etag():
+    return '"{}"'.format(solar_manager.version_tag())
+
+@app.json(etag=state_etag)
+def managercfg(verb, cfg, since_version='', include=''):
+    # since_version (or If-None-Match) only returns the values changed since then
+    if verb == webserver.POST:
+        solar_manager.set_json(cfg)
+        return solar_manager.get_json()
+    since = since_version or webserver.request_header(cfg, 'If-None-Match')
+    since = since.strip('"') if since else None
+    include = include.split(',') if include else ()
+    state = solar_manager.get_json(since, include)
+    if since == state['version'] and not include:
+        raise webserver.NotModifiedError(state_etag())
+    return state
+
+@app.json()
+def resistance(verb, _):
+    value = solar_manager.get_resistance()
+    if verb == webserver.POST:
+        value = solar_manager.set_resistance(not value)
+    return dict(value=value)
+
+@app.json()
+def reset(verb, _):
+    if verb == webserver.POST:
+        solar_manager.reset()
+        log.clear()
+        log.important('Resetting server status...')
+    return ''
+
+@app.json()
+def logcfg(verb, cfg):
+    if verb == webserver.POST:
+        log.set_levels(cfg.get('log_level'), cfg.get('web_log_level'))
+        log.set_web_log_size(cfg.get('web_log_size', log.WEB_LOG_SIZE))
+    return dict(log_level=log.LOG_LEVEL,
+                web_log_level=log.WEB_LOG_LEVEL,
+                web_log_size=log.WEB_LOG_SIZE)
+
+@app.json()
+def wifioff(verb, _):
+    v = False
+    if verb == webserver.POST:
+        wifi_tracker.schedule_toggle = True
+        v = True
+    return dict(wifioff=v)
+
+@app.plain()
+def logs(verb, _, mode='', size='4096', since='0', until='', kind='events'):
+    # mode=tail (last `size` bytes) or mode=range (since/until secs) read from flash,
+    # kind=events (IMPORTANT) or kind=log (warnings and errors)
+    if log_sink and mode:
+        check_bulk()
+        if kind not in log_sink.kinds:
+            kind = 'events'
+    if log_sink and mode == 'tail':
+        return log_sink.stream_tail(int(size), kind)
+    if log_sink and mode == 'range':
+        return log_sink.stream_range(int(since), int(until) if until else None, kind)
+    return log.stream_history()
+
+@app.plain()
+def logfrequency(verb, _):
+    return log.stream_frequency()
+
+def check_bulk():
+    if not solar_manager.memory_governor.allow_bulk():
+        raise webserver.ServiceUnavailableError('Low memory, try again later')
+
+@app.binary('/export')
+def export_binary(verb, _, names=''):
+    check_bulk()
+    return export.stream_binary(solar_manager.history, names and names.split(','))
+
+@app.csv('/export.csv')
+def export_csv(verb, _, names=''):
+    check_bulk()
+    return export.stream_csv(solar_manager.history, names and names.split(','))
+
+@app.binary('/trace')
+def trace(verb, _, part='0'):
+    # part=0 is the current file, part=N the Nth previous one
+    if not solar_manager.recorder:
+        return b''
+    check_bulk()
+    files = list(solar_manager.recorder.files())
+    index = len(files) - 1 - int(part)
+    return webserver.yield_chunks(files[index], 'rb') if index >= 0 else b''
+
+@app.plain('/metrics')
+def metrics_endpoint(verb, _):
+    return metrics.stream_prometheus()
+
+@app.json()
+def summary(verb, _):
+    # Today's counters so far, and yesterday's. Board clock days, the RTC isn't
+    # set: they start at boot, dated from 2000-01-01
+    counters = solar_manager.counters
+    return dict(clock='board', today=counters.summary(), yesterday=counters.previous)
+
+@app.json()
+def boot(verb, _):
+    # ms since main.py started for each boot stage
+    return boot_timings
+
+@app.html('/')
+def index(verb, _):
+    return webserver.serve_file('/client.html', {'@=SERVER_ADDRESS=@':'',
+                                                 '@=AUTH_TOKEN=@':config.AUTH_TOKEN})
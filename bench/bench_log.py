@@ -0,0 +1,48 @@
+# Per-tic cost of SolarManager.run_tic debug logging at LOG_LEVEL=INFO.
+# Run on the board with `mpremote run bench/bench_log.py`.
+import utime
+import log
+
+TICS = 2000
+ROWS = (('ac_enabled', True), ('inverter_usb', 1750), ('panels', 630), ('resistance', False))
+
+
+def unguarded(time):
+    log.debug('Collecting devices...')
+    for name, value in ROWS:
+        row = (value, time)
+        log.debug('{}:{}', name, row)
+
+
+def guarded(time):
+    if log.DEBUG_ENABLED:
+        log.debug('Collecting devices...')
+    for name, value in ROWS:
+        row = (value, time)
+        if log.DEBUG_ENABLED:
+            log.debug('{}:{}', name, row)
+
+
+def stripped(time):
+    for name, value in ROWS:
+        row = (value, time)
+
+
+def run(func):
+    start = utime.ticks_us()
+    for time in range(TICS):
+        func(time)
+    return utime.ticks_diff(utime.ticks_us(), start) / TICS
+
+
+def main():
+    log.set_levels(log.INFO, log.IMPORTANT)
+    results = {}
+    for func in (unguarded, guarded, stripped):
+        results[func.__name__] = run(func)
+    base = results['unguarded']
+    for name, us in results.items():
+        print('{}: {:.2f} us/tic (saves {:.2f} us/tic)'.format(name, us, base - us))
+
+
+main()
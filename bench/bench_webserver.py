@@ -0,0 +1,227 @@
+"""
+Load test webserver.Server with client.html's traffic (CPython).
+
+main.py runs on the simulated board (sim, realtime clock) in a subprocess
+while N dashboards poll it like client.html does: devicesread every second,
+managercfg every 10s, logs + logfrequency every 5s and a resistance toggle
+every 30s (--speedup divides those periods to push the board harder).
+Prints a JSON report with throughput, p50/p99 latency per
+endpoint, the board peak memory (tracemalloc) and connection errors.
+
+    python bench/bench_webserver.py --clients 8 --duration 60 --out report.json
+    python bench/bench_webserver.py --clients 32 --speedup 10
+    python bench/bench_webserver.py --compare report.json   # exit 1 on regression
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import pathlib
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+# endpoint, verb, period (secs)
+TRAFFIC = (
+    ('devicesread', 'GET', 1),
+    ('managercfg', 'GET', 10),
+    ('logs', 'GET', 5),
+    ('logfrequency', 'GET', 5),
+    ('resistance', 'POST', 30),
+)
+TIMEOUT = 10
+
+
+def board(port, out):
+    """Subprocess side: boot main.py until SIGTERM, then write memory stats to `out`"""
+    import tracemalloc
+    sys.path.insert(0, str(ROOT))
+    import sim
+    from sim import __main__ as sim_main, hardware, traces
+    sim.install(realtime=True, flash=sim_main.make_flash(), ports={80: port})
+    hardware.reset()
+    traces.SolarDay().attach()
+    # The board heap isn't modelled here, keep MemoryGovernor out of the way
+    hardware.HEAP_SIZE = 1 << 30
+    import main
+    main.solar_manager.enabled = True
+
+    def stop(*_):
+        main.solar_manager.stop = True
+    signal.signal(signal.SIGTERM, stop)
+    tracemalloc.start()
+    main.main()
+    current, peak = tracemalloc.get_traced_memory()
+    with open(out, 'w') as fp:
+        json.dump(dict(peak_bytes=peak, current_bytes=current,
+                       tics=main.solar_manager.tics_count + 1), fp)
+
+
+async def request(host, port, verb, endpoint, body=b''):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = '{} /{} HTTP/1.1\r\nHost: {}\r\nContent-type: text/plain\r\nContent-Length: {}\r\n\r\n'
+        writer.write(head.format(verb, endpoint, host, len(body)).encode() + body)
+        await writer.drain()
+        # The board closes the connection after each response
+        data = await reader.read()
+    finally:
+        writer.close()
+    status = int(data.split(b' ', 2)[1]) if data.startswith(b'HTTP/') else 0
+    return status, len(data)
+
+
+async def dashboard(host, port, deadline, stats, auth_token, speedup):
+    """One client.html instance, with every periodic call on its own schedule"""
+    async def periodic(endpoint, verb, period):
+        period /= speedup
+        body = json.dumps(dict(auth_token=auth_token, payload=None)).encode() if verb == 'POST' else b''
+        next_call = time.perf_counter()
+        while next_call < deadline:
+            start = time.perf_counter()
+            try:
+                status, size = await asyncio.wait_for(request(host, port, verb, endpoint, body), TIMEOUT)
+            except asyncio.TimeoutError:
+                stats.errors['timeout'] += 1
+            except OSError as e:
+                stats.errors[e.__class__.__name__] += 1
+            else:
+                stats.latencies[endpoint].append(time.perf_counter() - start)
+                stats.bytes += size
+                if status != 200:
+                    stats.errors['http_{}'.format(status)] += 1
+            next_call += period
+            if next_call < deadline:
+                await asyncio.sleep(max(0, next_call - time.perf_counter()))
+    await asyncio.gather(*(periodic(*t) for t in TRAFFIC))
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.bytes = 0
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return dict(count=0)
+
+    def at(p):
+        return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+    return dict(count=len(values), p50_ms=at(0.5), p99_ms=at(0.99), max_ms=round(values[-1] * 1000, 2))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(host, port, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            await request(host, port, 'GET', 'devicesread')
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def load(host, port, clients, duration, speedup, ramp):
+    stats = Stats()
+    start = time.perf_counter()
+    deadline = start + duration
+    # Spread the clients so they don't all poll on the same tick
+    tasks = []
+    for i in range(clients):
+        tasks.append(asyncio.ensure_future(dashboard(host, port, deadline, stats, auth_token(), speedup)))
+        await asyncio.sleep(ramp / clients)
+    await asyncio.gather(*tasks)
+    return stats, time.perf_counter() - start
+
+
+def auth_token():
+    sys.path.insert(0, str(ROOT / 'sim' / 'defaults'))
+    import config
+    return config.AUTH_TOKEN
+
+
+def run(clients, duration, speedup=1, ramp=1.0):
+    host, port = '127.0.0.1', free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, 'board.json')
+        # The board logs to stdout, drop it
+        proc = subprocess.Popen([sys.executable, __file__, '--board', str(port), out],
+                                stdout=subprocess.DEVNULL, cwd=str(ROOT))
+        try:
+            asyncio.run(wait_ready(host, port))
+            stats, elapsed = asyncio.run(load(host, port, clients, duration, speedup, ramp))
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=30)
+        with open(out) as fp:
+            board_stats = json.load(fp)
+    requests = sum(len(v) for v in stats.latencies.values())
+    return dict(clients=clients,
+                speedup=speedup,
+                duration_seconds=round(elapsed, 2),
+                requests=requests,
+                requests_per_second=round(requests / elapsed, 2),
+                bytes_per_request=round(stats.bytes / requests) if requests else None,
+                latency=percentiles([l for v in stats.latencies.values() for l in v]),
+                endpoints={name: percentiles(v) for name, v in sorted(stats.latencies.items())},
+                errors=dict(stats.errors),
+                board=board_stats)
+
+
+def regressions(report, baseline, tolerance):
+    found = []
+    if report['requests_per_second'] < baseline['requests_per_second'] * (1 - tolerance):
+        found.append('requests_per_second')
+    for key in ('p50_ms', 'p99_ms'):
+        if report['latency'].get(key, 0) > baseline['latency'].get(key, 0) * (1 + tolerance):
+            found.append('latency.' + key)
+    if report['board']['peak_bytes'] > baseline['board']['peak_bytes'] * (1 + tolerance):
+        found.append('board.peak_bytes')
+    if sum(report['errors'].values()) > sum(baseline['errors'].values()):
+        found.append('errors')
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=8, help='simulated dashboards')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+    parser.add_argument('--speedup', type=float, default=1, help='divide the polling periods')
+    parser.add_argument('--out', help='also write the report to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='fail if worse than this report')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    parser.add_argument('--board', nargs=2, metavar=('PORT', 'OUT'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.board:
+        board(int(args.board[0]), args.board[1])
+        return
+    report = run(args.clients, args.duration, args.speedup)
+    if args.compare:
+        with open(args.compare) as fp:
+            report['regressions'] = regressions(report, json.load(fp), args.tolerance)
+    print(json.dumps(report))
+    if args.out:
+        with open(args.out, 'w') as fp:
+            json.dump(report, fp, indent=1)
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# HTTP load generator for the host server (CPython).
+#
+#   python server.py &
+#   python bench/loadgen.py http://127.0.0.1:8000/ http://127.0.0.1:8000/static/petite-vue-module.min.js
+#
+# Every worker keeps one connection open and loops over the URLs, sending
+# the previous ETag back like a browser would. Workers are spread over
+# --processes so the generator isn't the bottleneck. Prints a JSON report.
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import time
+
+import httpx
+
+
+async def worker(client, urls, deadline, latencies, stats, revalidate):
+    etags = {}
+    while time.perf_counter() < deadline:
+        for url in urls:
+            headers = {}
+            if revalidate and url in etags:
+                headers['If-None-Match'] = etags[url]
+            start = time.perf_counter()
+            try:
+                resp = await client.get(url, headers=headers)
+            except httpx.HTTPError:
+                stats['errors'] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            stats[resp.status_code] += 1
+            stats['bytes'] += resp.num_bytes_downloaded
+            if 'etag' in resp.headers:
+                etags[url] = resp.headers['etag']
+
+
+async def run_process(urls, concurrency, duration, encoding, revalidate):
+    latencies = []
+    stats = collections.Counter(errors=0, bytes=0)
+    limits = httpx.Limits(max_connections=concurrency)
+    # Send the header explicitly to get what a browser gets (httpx still decodes it)
+    async with httpx.AsyncClient(limits=limits, headers={'Accept-Encoding': encoding}) as client:
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(*(worker(client, urls, deadline, latencies, stats, revalidate)
+                               for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, stats, elapsed
+
+
+def process_main(args):
+    return asyncio.run(run_process(*args))
+
+
+def run(urls, concurrency, duration, encoding, revalidate, processes):
+    per_process = max(1, concurrency // processes)
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(process_main, [(urls, per_process, duration, encoding, revalidate)] * processes)
+    latencies = sorted(l for result, _, _ in results for l in result)
+    stats = sum((s for _, s, _ in results), collections.Counter(errors=0))
+    elapsed = max(e for _, _, e in results)
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None
+
+    return dict(requests=len(latencies),
+                requests_per_second=round(len(latencies) / elapsed, 1),
+                p50_ms=percentile(0.5),
+                p99_ms=percentile(0.99),
+                wire_bytes_per_request=round(stats.pop('bytes') / len(latencies)) if latencies else None,
+                status={str(k): v for k, v in stats.items()})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='HTTP load generator')
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--processes', type=int, default=max(1, multiprocessing.cpu_count() // 2))
+    parser.add_argument('--encoding', default='gzip, br', help='Accept-Encoding header')
+    parser.add_argument('--no-revalidate', action='store_true', help="don't send If-None-Match")
+    args = parser.parse_args(argv)
+    report = run(args.urls, args.concurrency, args.duration, args.encoding,
+                 not args.no_revalidate, args.processes)
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import ustruct
+
+# Binary export frame (all little-endian):
+#   header: magic(4s) version(B) series_count(B)
+#   per series: name_len(B) name(bytes) count(I)
+#   then `count` records of time(I) value(h)
+MAGIC = b'USLR'
+VERSION = 1
+HEADER_FMT = '<4sBB'
+SERIES_FMT = '<B'
+COUNT_FMT = '<I'
+RECORD_FMT = '<Ih'
+RECORD_SIZE = ustruct.calcsize(RECORD_FMT)
+CHUNK_RECORDS = 128
+
+
+def _snapshot(history, name):
+    # Copy only the references, so a tic purging the list while we
+    # are draining the socket doesn't shift the rows under our feet
+    return tuple(history[name])
+
+
+def _names(history, names):
+    # Unknown names are skipped
+    return [n for n in names if n in history] if names else sorted(history)
+
+
+def stream_binary(history, names=None):
+    names = _names(history, names)
+    yield ustruct.pack(HEADER_FMT, MAGIC, VERSION, len(names))
+    buf = bytearray(RECORD_SIZE * CHUNK_RECORDS)
+    mv = memoryview(buf)
+    for name in names:
+        rows = _snapshot(history, name)
+        encoded = name.encode()
+        yield ustruct.pack(SERIES_FMT, len(encoded))
+        yield encoded
+        yield ustruct.pack(COUNT_FMT, len(rows))
+        offset = 0
+        for value, time in rows:
+            ustruct.pack_into(RECORD_FMT, buf, offset, time, int(value))
+            offset += RECORD_SIZE
+            if offset == len(buf):
+                yield mv
+                offset = 0
+        if offset:
+            yield mv[:offset]
+
+
+def stream_csv(history, names=None):
+    names = _names(history, names)
+    yield 'name,time,value\n'
+    for name in names:
+        for value, time in _snapshot(history, name):
+            yield '{},{},{}\n'.format(name, time, int(value))
@@ -1,5 +1,6 @@
 import gc
 import utime
+import metrics
 
 
 MEM_FREE_THRESHOLD=20000
@@ -28,6 +29,48 @@ LOG_LEVEL = INFO
 
 WEB_LOG_SIZE = 20
 WEB_LOG_LEVEL = IMPORTANT
+# Cheap guards to check before building log arguments:
+#   if log.DEBUG_ENABLED:
+#       log.debug('{}:{}', name, row)
+# Keep them updated through set_levels(). tools/strip_debug.py removes
+# guarded and bare debug calls from the deployed modules.
+DEBUG_ENABLED = False
+_MIN_LEVEL = min(LOG_LEVEL, WEB_LOG_LEVEL)
+# Persistent log files (see logfile.py), disabled by default
+FILE_LOG_LEVEL = IMPORTANT
+_file_sink = None
+# Max distinct messages tracked by the frequency table (least recently seen evicted)
+WEB_LOG_FREQUENCY_SIZE = 30
+
+
+def set_levels(log_level=None, web_log_level=None, file_log_level=None):
+    global LOG_LEVEL, WEB_LOG_LEVEL, FILE_LOG_LEVEL
+    if log_level is not None:
+        LOG_LEVEL = log_level
+    if web_log_level is not None:
+        WEB_LOG_LEVEL = web_log_level
+    if file_log_level is not None:
+        FILE_LOG_LEVEL = file_log_level
+    _update_guards()
+
+
+def set_file_sink(sink, level=None):
+    # sink: logfile.FileSink (or anything with write(time, level, msg, template)), None to disable
+    global _file_sink
+    _file_sink = sink
+    set_levels(file_log_level=level)
+
+
+def _update_guards():
+    global DEBUG_ENABLED, _MIN_LEVEL
+    _MIN_LEVEL = min(LOG_LEVEL, WEB_LOG_LEVEL)
+    if _file_sink:
+        _MIN_LEVEL = min(_MIN_LEVEL, FILE_LOG_LEVEL)
+    DEBUG_ENABLED = _MIN_LEVEL <= DEBUG
+
+
+def is_enabled(level):
+    return _MIN_LEVEL <= level
 
 
 def debug(msg, *args, **kwargs):
@@ -42,35 +85,144 @@ def info(msg, *args, **kwargs):
     print_log(INFO, msg, *args, **kwargs)
 
 
-web_log_history = []
-web_log_frequency = {}
+# Web log ring records: [time, level, msg_id, args, kwargs, text]
+# text is the formatted line, filled lazily the first time it's needed
+_TIME, _LEVEL, _MSG, _ARGS, _KWARGS, _TEXT = range(6)
+# Message table entries (indexed by msg_id): [msg, level, count, last_seen]
+_MSG_TEXT, _MSG_LEVEL, _MSG_COUNT, _MSG_LAST_SEEN = range(4)
+
+
+def _new_ring(size):
+    return [[0, 0, 0, (), None, ''] for _ in range(size)]
+
+
+_ring = _new_ring(WEB_LOG_SIZE)
+_ring_pos = 0 # next slot to write
+_ring_count = 0
+_msgs = []
+_msg_ids = {}
+
+
 def print_log(level, msg, *args, **kwargs):
+    if level < _MIN_LEVEL:
+        return
     if LOG_LEVEL <= level:
         if args or kwargs:
             print(msg.format(*args, **kwargs))
     if WEB_LOG_LEVEL <= level:
-        time = utime.time()
-        web_log_history.append((time,level,msg,args,kwargs))
-        if msg not in web_log_frequency:
-            web_log_frequency[msg] = dict(count=0, level=level)
-        web_log_frequency[msg]['count'] += 1
-        web_log_frequency[msg]['last_seen'] = time
-        purge_history()
-
-
-def purge_history():
-    # We allow a gap of 10
-    if len(web_log_history) >= WEB_LOG_SIZE + 10:
-        web_log_history[:10] = []
+        _record(level, msg, args, kwargs)
+    if _file_sink and FILE_LOG_LEVEL <= level:
+        _file_sink.write(utime.time(), level, msg.format(*args, **kwargs), msg)
+
+
+def _primitive(v):
+    # Don't keep arbitrary objects alive just to format them later
+    if v is None or isinstance(v, (int, float, str)):
+        return v
+    return str(v)
+
+
+def _record(level, msg, args, kwargs):
+    global _ring_pos, _ring_count
+    time = utime.time()
+    msg_id = _intern(msg, level, time)
+    rec = _ring[_ring_pos]
+    rec[_TIME] = time
+    rec[_LEVEL] = level
+    rec[_MSG] = msg_id
+    rec[_ARGS] = tuple(_primitive(a) for a in args) if args else ()
+    rec[_KWARGS] = {k:_primitive(v) for k,v in kwargs.items()} if kwargs else None
+    rec[_TEXT] = None
+    _ring_pos = (_ring_pos + 1) % len(_ring)
+    if _ring_count < len(_ring):
+        _ring_count += 1
+
+
+def _intern(msg, level, time):
+    msg_id = _msg_ids.get(msg)
+    if msg_id is None:
+        if len(_msgs) < WEB_LOG_FREQUENCY_SIZE:
+            msg_id = len(_msgs)
+            _msgs.append([msg, level, 0, time])
+        else:
+            msg_id = _evict_lru()
+            _msgs[msg_id][:] = [msg, level, 0, time]
+        _msg_ids[msg] = msg_id
+    entry = _msgs[msg_id]
+    entry[_MSG_COUNT] += 1
+    entry[_MSG_LAST_SEEN] = time
+    return msg_id
+
+
+def _evict_lru():
+    msg_id = 0
+    for i in range(1, len(_msgs)):
+        if _msgs[i][_MSG_LAST_SEEN] < _msgs[msg_id][_MSG_LAST_SEEN]:
+            msg_id = i
+    # Records still pointing to the evicted message get formatted now
+    for rec in _ring:
+        if rec[_MSG] == msg_id and rec[_TEXT] is None:
+            _format(rec)
+    del _msg_ids[_msgs[msg_id][_MSG_TEXT]]
+    return msg_id
+
+
+def _format(rec):
+    if rec[_TEXT] is None:
+        msg = _msgs[rec[_MSG]][_MSG_TEXT].format(*rec[_ARGS], **(rec[_KWARGS] or {}))
+        rec[_TEXT] = '{}:{}: {}\n'.format(rec[_TIME], INT_TO_LABEL[rec[_LEVEL]], msg)
+        rec[_ARGS] = ()
+        rec[_KWARGS] = None
+    return rec[_TEXT]
+
+
+def stream_history():
+    # Newest first
+    size = len(_ring)
+    for i in range(1, _ring_count + 1):
+        yield _format(_ring[(_ring_pos - i) % size])
+
+
+def stream_frequency():
+    for entry in sorted(_msgs):
+        yield '{}:{}: {}: {}\n'.format(entry[_MSG_LAST_SEEN], INT_TO_LABEL[entry[_MSG_LEVEL]],
+                                        entry[_MSG_TEXT], entry[_MSG_COUNT])
+
+
+def set_web_log_size(size):
+    global WEB_LOG_SIZE, _ring, _ring_pos, _ring_count
+    size = max(1, size)
+    if size == WEB_LOG_SIZE:
+        return
+    # Keep the newest records that still fit
+    old = [_ring[(_ring_pos - i) % len(_ring)] for i in range(min(_ring_count, size), 0, -1)]
+    ring = _new_ring(size)
+    ring[:len(old)] = old
+    WEB_LOG_SIZE = size
+    _ring = ring
+    _ring_count = len(old)
+    _ring_pos = _ring_count % size
+
+
+def clear():
+    global _ring, _ring_pos, _ring_count
+    _ring = _new_ring(WEB_LOG_SIZE)
+    _ring_pos = 0
+    _ring_count = 0
+    _msgs.clear()
+    _msg_ids.clear()
 
 
 def garbage_collect(threshold=MEM_FREE_THRESHOLD):
     orig_free = gc.mem_free()
     if orig_free < threshold:
+        start = metrics.ticks()
         gc.collect()
+        metrics.GC_PAUSE.observe_since(start)
         now_free=gc.mem_free()
-        debug('GC: was={orig_free}, now={now_free}',
-              orig_free=orig_free, now_free=now_free)
+        if DEBUG_ENABLED:
+            debug('GC: was={orig_free}, now={now_free}',
+                  orig_free=orig_free, now_free=now_free)
         return now_free
     return orig_free
 
@@ -0,0 +1,171 @@
+import uos
+import log
+
+CHUNK_SIZE = 1024
+
+
+class RotatingFiles:
+    # `<path>/<name>.0` appended in batches, shifted to .1 ... when full
+    def __init__(self, path, name, max_files, max_file_size):
+        self.path = path
+        self.name = name
+        self.max_files = max_files
+        self.max_file_size = max_file_size
+        self.pending = []
+        self.size = self._file_size(0)
+
+    def file_path(self, index):
+        return '{}/{}.{}'.format(self.path, self.name, index)
+
+    def _file_size(self, index):
+        try:
+            return uos.stat(self.file_path(index))[6]
+        except OSError:
+            return 0
+
+    def flush(self):
+        if not self.pending:
+            return
+        size = 0
+        for line in self.pending:
+            size += len(line)
+        if self.size and self.size + size > self.max_file_size:
+            self.rotate()
+        with open(self.file_path(0), 'a') as fp:
+            for line in self.pending:
+                fp.write(line)
+        self.size += size
+        self.pending.clear()
+
+    def rotate(self):
+        try:
+            uos.remove(self.file_path(self.max_files - 1))
+        except OSError:
+            pass
+        for i in range(self.max_files - 2, -1, -1):
+            try:
+                uos.rename(self.file_path(i), self.file_path(i + 1))
+            except OSError:
+                pass
+        self.size = 0
+
+    def files(self):
+        # Oldest first
+        for i in range(self.max_files - 1, -1, -1):
+            size = self._file_size(i)
+            if size:
+                yield self.file_path(i), size
+
+
+class FileSink:
+    '''
+    Log files on flash, used through log.set_file_sink(). IMPORTANT events
+    and the other levels rotate separately, the latter only counting a
+    message repeated within repeat_period secs.
+    '''
+    def __init__(self, path='/logs', max_files=4, max_file_size=16*1024,
+                 event_files=4, batch_size=8, flush_period=60, repeat_period=60):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_period = flush_period
+        self.repeat_period = repeat_period
+        self.last_flush = 0
+        self.pending = 0
+        # msg template (literals, so bounded) -> [time last written, repeats since]
+        self.repeats = {}
+        self.failures = 0
+        self.enabled = True
+        try:
+            uos.mkdir(path)
+        except OSError:
+            pass # already exists
+        self.kinds = dict(events=RotatingFiles(path, 'events', event_files, max_file_size),
+                          log=RotatingFiles(path, 'log', max_files, max_file_size))
+
+    def write(self, time, level, msg, template=None):
+        if not self.enabled:
+            return
+        kind = 'events' if level == log.IMPORTANT else 'log'
+        if kind == 'log':
+            # Errors repeated every tic (eg: within a hold) must not rotate everything out
+            key = template or msg
+            last = self.repeats.get(key)
+            if last is not None and time - last[0] < self.repeat_period:
+                last[1] += 1
+                return
+            if last is not None and last[1]:
+                msg = '{} (repeated {} times)'.format(msg, last[1])
+            self.repeats[key] = [time, 0]
+        self.kinds[kind].pending.append('{}:{}: {}\n'.format(time, log.INT_TO_LABEL[level], msg))
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def run_tic(self, time):
+        if self.pending and time - self.last_flush >= self.flush_period:
+            self.flush()
+            self.last_flush = time
+
+    def reset(self):
+        pass
+
+    def flush(self):
+        try:
+            for files in self.kinds.values():
+                files.flush()
+        except OSError as e:
+            # Flash full or broken: drop the file logs, never the control loop
+            self.failures += 1
+            self.enabled = False
+            for files in self.kinds.values():
+                files.pending.clear()
+            print('Log files disabled {!r}'.format(e))
+        self.pending = 0
+
+    def status(self):
+        return dict(enabled=self.enabled, failures=self.failures,
+                    sizes={kind: files.size for kind, files in self.kinds.items()})
+
+    def stream_tail(self, nbytes, kind='events'):
+        self.flush()
+        files = list(self.kinds[kind].files())
+        total = 0
+        for _, size in files:
+            total += size
+        skip = max(0, total - nbytes)
+        # Only the first partial file needs to drop its (cut) first line
+        cut = bool(skip)
+        for path, size in files:
+            if skip >= size:
+                skip -= size
+                continue
+            with open(path, 'rb') as fp:
+                fp.seek(skip)
+                if cut:
+                    fp.readline()
+                    cut = False
+                skip = 0
+                chunk = fp.read(CHUNK_SIZE)
+                while chunk:
+                    yield chunk
+                    chunk = fp.read(CHUNK_SIZE)
+
+    def stream_range(self, since=0, until=None, kind='events'):
+        self.flush()
+        for path, _ in self.kinds[kind].files():
+            with open(path, 'rb') as fp:
+                line = fp.readline()
+                while line:
+                    time = parse_time(line)
+                    if until is not None and time is not None and time > until:
+                        return
+                    if time is not None and time >= since:
+                        yield line
+                    line = fp.readline()
+
+
+def parse_time(line):
+    try:
+        return int(float(line[:line.find(b':')]))
+    except ValueError:
+        return None
@@ -1,99 +1,90 @@
-import uasyncio
-import ujson
-import machine
 import utime
+_boot_start = utime.ticks_ms()
+import sys
+import uasyncio
 import log
-import webserver
 import solar
 import config
 
-
-def stream_web_log():
-    for l in reversed(log.web_log_history):
-        msg = l[2].format(*l[3], **l[4])
-        yield '{}:{}: {}\n'.format(l[0], log.INT_TO_LABEL[l[1]], msg)
-
-def stream_web_log_frequency():
-    for k in sorted(log.web_log_frequency):
-        v = log.web_log_frequency[k]
-        yield '{}:{}: {}: {}\n'.format(v['last_seen'], log.INT_TO_LABEL[v['level']], k, v['count'])
-
-wifi_tracker = solar.WifiTracker(config.AP_WIFI_ESSID, config.AP_WIFI_PASSWORD)
-solar_manager = solar.SolarManager(wifi_tracker)
-app = webserver.Server(static_path='/static/',
-                       auth_token=config.AUTH_TOKEN,
-                       pre_request_hook=lambda: uasyncio.create_task(wifi_tracker.blink()))
-
-@app.json()
-def devicesread(verb, _):
-    return solar_manager.latest_read()
-
-@app.json()
-def managercfg(verb, cfg):
-    if verb == webserver.POST:
-        solar_manager.set_json(cfg)
-    return solar_manager.get_json()
-
-@app.json()
-def resistance(verb, _):
-    value = solar_manager.get_resistance()
-    if verb == webserver.POST:
-        value = solar_manager.set_resistance(not value)
-    return dict(value=value)
-
-@app.json()
-def reset(verb, _):
-    if verb == webserver.POST:
-        solar_manager.reset()
-        log.web_log_history.clear()
-        log.web_log_frequency.clear()
-        log.important('Resetting server status...')
-    return ''
-
-@app.json()
-def logcfg(verb, cfg):
-    if verb == webserver.POST:
-        log.LOG_LEVEL = cfg.get('log_level', log.LOG_LEVEL)
-        log.WEB_LOG_LEVEL = cfg.get('web_log_level', log.WEB_LOG_LEVEL)
-        log.WEB_LOG_SIZE = cfg.get('web_log_size', log.WEB_LOG_SIZE)
-    return dict(log_level=log.LOG_LEVEL,
-                web_log_level=log.WEB_LOG_LEVEL,
-                web_log_size=log.WEB_LOG_SIZE)
-
-@app.json()
-def wifioff(verb, _):
-    v = False
-    if verb == webserver.POST:
-        wifi_tracker.schedule_toggle = True
-        v = True
-    return dict(wifioff=v)
-
-@app.plain()
-def logs(verb, _):
-    return stream_web_log()
-
-@app.plain()
-def logfrequency(verb, _):
-    return stream_web_log_frequency()
-
-@app.html('/')
-def index(verb, _):
-    return webserver.serve_file('/client.html', {'@=SERVER_ADDRESS=@':'',
-                                                 '@=AUTH_TOKEN=@':config.AUTH_TOKEN})
+# ms since main.py started, per boot stage (served on /boot)
+boot_timings = {}
+
+def mark(stage):
+    boot_timings[stage] = utime.ticks_diff(utime.ticks_ms(), _boot_start)
+
+mark('imports')
+solar_manager = solar.SolarManager()
+# Otherwise sampling and resistance control wait for a dashboard to enable them
+solar_manager.enabled = getattr(config, 'ENABLED_AT_BOOT', False)
+solar_manager.on_first_sample = lambda: mark('first_sample')
+log_sink = None
+if getattr(config, 'LOG_FILES', False):
+    # Keep important events (resistance switches, inverter edges) across reboots
+    import logfile
+    log_sink = logfile.FileSink()
+    log.set_file_sink(log_sink)
+    solar_manager.services.append(log_sink)
+    solar_manager.log_sink = log_sink
+    solar_manager.allow_get_bulky.add('log_sink__status')
+if getattr(config, 'TRACE_RECORDING', False):
+    # Raw samples for `python -m sim.replay`, download them from /trace
+    import recorder
+    solar_manager.recorder = recorder.TraceRecorder()
+    solar_manager.allow_get_bulky.add('recorder__status')
+if getattr(config, 'POWER_SAVING', False):
+    # Light sleep between tics while the AP is off, lower clock at night
+    import power
+    solar_manager.scheduler = power.PowerScheduler(solar_manager)
+    solar_manager.services.append(solar_manager.scheduler)
+    solar_manager.allow_get_bulky.add('scheduler__status')
+wifi_tracker = None
+app = None
+
+async def start_web():
+    # AP and web stack, only once the sampling loop is running
+    global wifi_tracker, app
+    wifi_tracker = solar.WifiTracker(config.AP_WIFI_ESSID, config.AP_WIFI_PASSWORD)
+    solar_manager.attach(wifi_tracker)
+    wifi_tracker.on()
+    mark('ap')
+    import api
+    api.init(solar_manager, wifi_tracker, log_sink, boot_timings)
+    mark('web_imports')
+    await api.app.run()
+    app = api.app
+    mark('web')
+
+async def boot():
+    sampling = uasyncio.create_task(solar_manager.loop_tasks())
+    # Let the first tic run (sampling and resistance safety logic when enabled)
+    await uasyncio.sleep(0)
+    mark('first_tic')
+    try:
+        await start_web()
+    except Exception as e:
+        # Keep sampling even without the web interface
+        log.error('Web startup failed {!r}', e)
+        sys.print_exception(e)
+    log.important('Boot timings (ms) {}', boot_timings)
+    await sampling
 
 def main():
     gmt, localt = utime.gmtime(), utime.localtime()
     assert gmt == localt
     log.garbage_collect()
-    log.LOG_LEVEL = log.INFO
+    log.set_levels(log.INFO)
     try:
-        wifi_tracker.on()
-        uasyncio.run(app.run())
-        uasyncio.run(solar_manager.loop_tasks())
+        uasyncio.run(boot())
     finally:
-        uasyncio.run(app.close())
+        if app:
+            uasyncio.run(app.close())
         _ = uasyncio.new_event_loop()
-    wifi_tracker.off()
+        if log_sink:
+            log_sink.flush()
+        if solar_manager.recorder:
+            solar_manager.recorder.flush()
+    if wifi_tracker:
+        wifi_tracker.off()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,99 @@
+import utime
+
+# Bucket upper bounds. Durations are observed as integer microseconds
+# (no float boxing per observation) and exported in seconds.
+LATENCY_BUCKETS_US = (500, 1000, 2000, 5000, 10000, 20000, 50000,
+                      100000, 200000, 500000, 1000000, 5000000)
+BYTES_BUCKETS = (128, 512, 2048, 8192, 32768, 131072)
+US_TO_SECONDS = 1000000
+# The sum carries into a second counter, both stay MicroPython small ints
+# (2**30) instead of growing into a heap allocated bigint after ~18 min
+SUM_CARRY = 1 << 20
+
+
+class Histogram:
+    '''
+    Fixed buckets histogram, observe() doesn't allocate.
+    Counts per bucket aren't cumulative here, they are at export time.
+    '''
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS_US, labels='', scale=US_TO_SECONDS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self.scale = scale
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.sum = 0
+        self.sum_carries = 0
+        self.count = 0
+        sep = ',' if labels else ''
+        self.bucket_labels = ['{}{}le="{}"'.format(labels, sep, b / scale if scale != 1 else b)
+                              for b in buckets]
+        self.bucket_labels.append('{}{}le="+Inf"'.format(labels, sep))
+
+    def observe(self, value):
+        buckets = self.buckets
+        i = 0
+        n = len(buckets)
+        while i < n and value > buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        total = self.sum + value
+        if total >= SUM_CARRY:
+            self.sum_carries += total // SUM_CARRY
+            total %= SUM_CARRY
+        self.sum = total
+        self.count += 1
+
+    def observe_since(self, start_us):
+        self.observe(utime.ticks_diff(utime.ticks_us(), start_us))
+
+    def stream_prometheus(self):
+        labels = '{' + self.labels + '}' if self.labels else ''
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            yield '{}_bucket{{{}}} {}\n'.format(self.name, self.bucket_labels[i], cumulative)
+        total = self.sum_carries * SUM_CARRY + self.sum
+        if self.scale != 1:
+            total /= self.scale
+        yield '{}_sum{} {}\n'.format(self.name, labels, total)
+        yield '{}_count{} {}\n'.format(self.name, labels, self.count)
+
+
+# name -> {labels: Histogram}, kept in creation order for the export
+_families = {}
+_family_names = []
+
+
+def histogram(name, help, buckets=LATENCY_BUCKETS_US, labels='', scale=US_TO_SECONDS):
+    '''Get or create (only the first time) the histogram for name+labels'''
+    family = _families.get(name)
+    if family is None:
+        family = _families[name] = {}
+        _family_names.append(name)
+    hist = family.get(labels)
+    if hist is None:
+        hist = family[labels] = Histogram(name, help, buckets, labels, scale)
+    return hist
+
+
+def ticks():
+    return utime.ticks_us()
+
+
+def stream_prometheus():
+    for name in _family_names:
+        family = _families[name]
+        first = True
+        for hist in family.values():
+            if first:
+                yield '# HELP {} {}\n'.format(name, hist.help)
+                yield '# TYPE {} histogram\n'.format(name)
+                first = False
+            for line in hist.stream_prometheus():
+                yield line
+
+
+GC_PAUSE = histogram('usolar_gc_pause_seconds', 'Duration of gc.collect() calls')
+LOOP_TIC = histogram('usolar_loop_tic_seconds', 'Duration of a whole SolarManager loop tic')
@@ -0,0 +1,123 @@
+import esp32
+import machine
+import uasyncio
+import utime
+import log
+import solar
+
+DAY_FREQ = 160000000
+NIGHT_FREQ = 80000000
+
+
+# Light-sleeps between tics while the AP is off and nothing changed for IDLE_AFTER
+# secs, woken by the flash button (ext0) or AC_ENABLED (ext1). Lower clock at night
+class PowerScheduler(solar.TrackerBase):
+    IDLE_AFTER = 30
+    FREQ_PERIOD = 60
+    REPORT_PERIOD = 60 * 60
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.ac_enabled = manager.devices['ac_enabled']
+        # Raw pins (not InvertedPin) to arm the wake up levels
+        self.wake_pins = dict(ac_enabled=machine.Pin(solar.AC_ENABLED_PIN),
+                              flash_button=machine.Pin(solar.FLASH_BUTTON_PIN, machine.Pin.IN))
+        self.armed = {}
+        self.arm_error = None
+        self.last_ac = self.ac_enabled.value()
+        self.last_change = 0
+        self.last_freq_check = 0
+        self.last_report = 0
+        self.night = False
+        self.time = 0
+        self.awake_ms = 0
+        self.asleep_ms = 0
+        self.sleeps = 0
+        self.pin_wakes = 0
+        self.last_wake = utime.ticks_ms()
+
+    def run_tic(self, time):
+        self.time = time
+        ac = self.ac_enabled.value()
+        if ac != self.last_ac:
+            self.last_ac = ac
+            self.last_change = time
+        if time - self.last_freq_check >= self.FREQ_PERIOD:
+            self.last_freq_check = time
+            self.update_freq()
+        if time - self.last_report >= self.REPORT_PERIOD:
+            self.last_report = time
+            log.info('Power duty_cycle={} sleeps={} pin_wakes={} freq={}',
+                     self.duty_cycle(), self.sleeps, self.pin_wakes, machine.freq())
+
+    def update_freq(self):
+        night = self.manager.devices['panels'].read() < solar.PV_10V
+        if night != self.night:
+            self.night = night
+            log.info('CPU frequency to {} (night={})', NIGHT_FREQ if night else DAY_FREQ, night)
+            machine.freq(NIGHT_FREQ if night else DAY_FREQ)
+
+    def is_idle(self):
+        wifi = self.manager.wifi_tracker
+        if self.arm_error:
+            return False
+        # Before the AP stage (wifi is None) the web server is still starting
+        if wifi is None or wifi.wifi_active or wifi.schedule_toggle:
+            return False
+        last_event = max(self.last_change,
+                         self.manager.resistance_tracker.switch_time,
+                         self.manager.inverter_tracker.last_event_time())
+        return self.time - last_event >= self.IDLE_AFTER
+
+    def arm(self):
+        # Wake on the next edge: a level trigger on the opposite level
+        for name, pin in self.wake_pins.items():
+            level = esp32.WAKEUP_ALL_LOW if pin.value() else esp32.WAKEUP_ANY_HIGH
+            if self.armed.get(name) == level:
+                continue
+            if name == 'flash_button':
+                esp32.wake_on_ext0(pin, level)
+            else:
+                esp32.wake_on_ext1((pin,), level)
+            self.armed[name] = level
+
+    async def sleep(self, secs):
+        if not self.is_idle():
+            await uasyncio.sleep(secs)
+            return
+        try:
+            self.arm()
+        except (ValueError, OSError) as e:
+            # Keep sampling without light sleeps
+            log.error('Light sleep disabled, wake up arming failed {!r}', e)
+            self.arm_error = repr(e)
+            await uasyncio.sleep(secs)
+            return
+        now = utime.ticks_ms()
+        self.awake_ms += utime.ticks_diff(now, self.last_wake)
+        machine.lightsleep(int(secs * 1000))
+        self.last_wake = utime.ticks_ms()
+        slept = utime.ticks_diff(self.last_wake, now)
+        self.asleep_ms += slept
+        self.sleeps += 1
+        remaining = 0
+        if machine.wake_reason() in (machine.EXT0_WAKE, machine.EXT1_WAKE):
+            self.pin_wakes += 1
+            # Awake until the next tic, a bit late rather than a tic within the same second
+            remaining = secs - slept / 1000 + 0.01
+        await uasyncio.sleep(max(0, remaining))
+
+    def duty_cycle(self):
+        awake = self.awake_ms + utime.ticks_diff(utime.ticks_ms(), self.last_wake)
+        total = awake + self.asleep_ms
+        return round(awake / total, 3) if total else 1
+
+    def status(self):
+        return dict(duty_cycle=self.duty_cycle(),
+                    idle=self.is_idle(),
+                    sleeps=self.sleeps,
+                    pin_wakes=self.pin_wakes,
+                    asleep_secs=self.asleep_ms // 1000,
+                    night=self.night,
+                    freq=machine.freq(),
+                    arm_error=self.arm_error)
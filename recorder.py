@@ -0,0 +1,108 @@
+import ustruct
+import uos
+import log
+
+# Trace file: header magic(4s) version(B), then fixed size records of
+#   time(I) panels(H) inverter_usb(H) ac_enabled(B) resistance(B)
+MAGIC = b'USTR'
+VERSION = 1
+HEADER_FMT = '<4sB'
+RECORD_FMT = '<IHHBB'
+RECORD_SIZE = ustruct.calcsize(RECORD_FMT)
+BUFFER_RECORDS = 64
+
+
+class TraceRecorder:
+    '''
+    Dumps the raw samples collected by SolarManager.run_tic, to be replayed
+    on the host with `python -m sim.replay`. Records are buffered in RAM and
+    appended BUFFER_RECORDS at a time to `path`, shifted to `<path>.1` ...
+    `<path>.<max_files - 1>` on boot (times restart at 0) or when full, all
+    of them within max_size bytes (~1 day of 1 Hz samples by default).
+    '''
+    def __init__(self, path='/trace.bin', max_size=1024*1024, max_files=8):
+        self.path = path
+        self.max_files = max_files
+        self.max_file_size = max_size // max_files
+        self.buf = bytearray(RECORD_SIZE * BUFFER_RECORDS)
+        self.offset = 0
+        self.enabled = True
+        self.failures = 0
+        self.size = self._file_size(0)
+        try:
+            if self.size > ustruct.calcsize(HEADER_FMT):
+                self.rotate()
+            elif not self.size:
+                self._start_file()
+        except OSError as e:
+            self._disable(e)
+
+    def file_path(self, index):
+        return '{}.{}'.format(self.path, index) if index else self.path
+
+    def _file_size(self, index):
+        try:
+            return uos.stat(self.file_path(index))[6]
+        except OSError:
+            return 0
+
+    def _start_file(self):
+        with open(self.path, 'wb') as fp:
+            fp.write(ustruct.pack(HEADER_FMT, MAGIC, VERSION))
+        self.size = ustruct.calcsize(HEADER_FMT)
+
+    def _disable(self, e):
+        # Flash full or broken: stop recording, never sampling
+        self.failures += 1
+        self.enabled = False
+        self.offset = 0
+        log.error('Trace recording disabled {!r}', e)
+
+    def record(self, time, history):
+        if not self.enabled:
+            return
+        ustruct.pack_into(RECORD_FMT, self.buf, self.offset, time,
+                          history['panels'][-1][0],
+                          history['inverter_usb'][-1][0],
+                          int(history['ac_enabled'][-1][0]),
+                          int(history['resistance'][-1][0]))
+        self.offset += RECORD_SIZE
+        if self.offset == len(self.buf):
+            self.flush()
+
+    def flush(self):
+        if not self.offset:
+            return
+        try:
+            if self.size + self.offset > self.max_file_size:
+                self.rotate()
+            with open(self.path, 'ab') as fp:
+                fp.write(memoryview(self.buf)[:self.offset])
+        except OSError as e:
+            self._disable(e)
+            return
+        self.size += self.offset
+        self.offset = 0
+
+    def rotate(self):
+        log.info('Rotating trace file {} size={}', self.path, self.size)
+        try:
+            uos.remove(self.file_path(self.max_files - 1))
+        except OSError:
+            pass
+        for i in range(self.max_files - 2, -1, -1):
+            try:
+                uos.rename(self.file_path(i), self.file_path(i + 1))
+            except OSError:
+                pass
+        self._start_file()
+
+    def files(self):
+        # Oldest first
+        self.flush()
+        for i in range(self.max_files - 1, -1, -1):
+            if self._file_size(i):
+                yield self.file_path(i)
+
+    def status(self):
+        return dict(enabled=self.enabled, failures=self.failures, size=self.size)
@@ -1,16 +1,41 @@
 import uvicorn
 import typing
 import jinja2
+import struct
+import urllib.request
+import array
+import asyncio
+import bisect
+import contextlib
+import datetime
+import os
+import pathlib
+import random
+import time
+import gzip
+import hashlib
+import mimetypes
+import re
+import httpx
 
 from os import PathLike
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+import json
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 class Jinja2TemplatesCustom(Jinja2Templates):
+    def __init__(self, directory: typing.Union[str, PathLike]):
+        # Starlette no longer calls _create_env itself
+        super().__init__(env=self._create_env(directory))
+
     def _create_env(
         self, directory: typing.Union[str, PathLike]
     ) -> "jinja2.Environment":
@@ -27,10 +52,490 @@ class Jinja2TemplatesCustom(Jinja2Templates):
         env.globals["url_for"] = url_for
         return env
 
-app = FastAPI()
+# Must match export.py on the device
+EXPORT_MAGIC = b'USLR'
+EXPORT_VERSION = 1
+EXPORT_HEADER = struct.Struct('<4sBB')
+EXPORT_COUNT = struct.Struct('<I')
+EXPORT_RECORD = struct.Struct('<Ih')
+
+History = typing.Dict[str, typing.List[typing.Tuple[int, int]]]
+
+
+def decode_export(data: bytes) -> History:
+    """Decode a /export binary frame into {name: [(value, time), ...]}"""
+    magic, version, series_count = EXPORT_HEADER.unpack_from(data, 0)
+    if magic != EXPORT_MAGIC or version != EXPORT_VERSION:
+        raise ValueError(f'Unknown export frame magic={magic!r} version={version}')
+    offset = EXPORT_HEADER.size
+    history = {}
+    for _ in range(series_count):
+        name_len = data[offset]
+        offset += 1
+        name = data[offset:offset + name_len].decode()
+        offset += name_len
+        count, = EXPORT_COUNT.unpack_from(data, offset)
+        offset += EXPORT_COUNT.size
+        end = offset + count * EXPORT_RECORD.size
+        history[name] = [(value, time) for time, value in
+                         EXPORT_RECORD.iter_unpack(data[offset:end])]
+        offset = end
+    return history
+
+
+def fetch_export(address: str, names: typing.Iterable[str] = ()) -> History:
+    url = address + '/export'
+    if names:
+        url += '?names=' + ','.join(names)
+    with urllib.request.urlopen(url) as resp:
+        return decode_export(resp.read())
+
+
+# Devices polled by the collector: USOLAR_DEVICES="name=http://host,other=http://host2"
+DEFAULT_DEVICES = "usolar=http://192.168.4.1"
+DATA_DIR = os.environ.get("USOLAR_DATA_DIR", "data")
+POLL_PERIOD = float(os.environ.get("USOLAR_POLL_PERIOD", "1"))
+
+
+def parse_devices(spec: str) -> typing.Dict[str, str]:
+    devices = {}
+    for item in filter(None, (i.strip() for i in spec.split(","))):
+        name, _, address = item.partition("=")
+        devices[name] = address.rstrip("/")
+    return devices
+
+
+class ColumnarStore:
+    """
+    Samples on disk partitioned as <root>/<device>/<YYYY-MM-DD>/<column>.bin,
+    each column a flat little-endian array: "time" float64 (unix secs, UTC
+    days), the device readings int32. Rows are buffered and appended in
+    batches, every column in a partition is kept as long as "time" (readings
+    missing from a poll are stored as 0). Range queries bisect the day's time
+    column and only read the needed slice of the value column.
+    """
+    TIME = "time"
+    TIME_TYPE = "d"
+    VALUE_TYPE = "i"
+
+    def __init__(self, root: str = DATA_DIR, batch_size: int = 60):
+        self.root = pathlib.Path(root)
+        self.batch_size = batch_size
+        self._pending: typing.Dict[typing.Tuple[str, str], typing.Dict[str, array.array]] = {}
+
+    @staticmethod
+    def day_of(timestamp: float) -> str:
+        return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+    def partition(self, device: str, day: str) -> pathlib.Path:
+        return self.root / device / day
+
+    def append(self, device: str, timestamp: float, values: typing.Mapping[str, int]):
+        # Convert first, a bad value must not leave the batch half appended
+        values = {name: int(value) for name, value in values.items()}
+        key = (device, self.day_of(timestamp))
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = {self.TIME: array.array(self.TIME_TYPE)}
+        pending[self.TIME].append(timestamp)
+        for name, value in values.items():
+            column = pending.get(name)
+            if column is None:
+                # Columns appearing later get backfilled with zeros
+                column = pending[name] = array.array(self.VALUE_TYPE, bytes(4 * (len(pending[self.TIME]) - 1)))
+            column.append(value)
+        for name, column in pending.items():
+            if name != self.TIME and name not in values:
+                column.append(0)
+        if len(pending[self.TIME]) >= self.batch_size:
+            self.flush(key)
+
+    def flush(self, key=None):
+        for k in [key] if key else list(self._pending):
+            pending = self._pending.pop(k, None)
+            if not pending:
+                continue
+            path = self.partition(*k)
+            path.mkdir(parents=True, exist_ok=True)
+            rows = self._rows(path / f"{self.TIME}.bin", self.TIME_TYPE)
+            batch = len(pending[self.TIME])
+            # Columns already on disk but missing from the whole batch get zeros too
+            names = set(pending) | {p.stem for p in path.glob("*.bin")}
+            for name in sorted(names, key=lambda n: n == self.TIME):
+                column = pending.get(name)
+                if column is None:
+                    column = array.array(self.VALUE_TYPE, bytes(4 * batch))
+                column_path = path / f"{name}.bin"
+                missing = rows - self._rows(column_path, column.typecode)
+                with open(column_path, "ab") as fp:
+                    if missing > 0:
+                        # First seen in this batch, pad the rows already on disk
+                        fp.write(bytes(missing * column.itemsize))
+                    column.tofile(fp)
+
+    @staticmethod
+    def _rows(path: pathlib.Path, typecode: str) -> int:
+        return path.stat().st_size // array.array(typecode).itemsize if path.exists() else 0
+
+    def days(self, device: str, start: float, end: float) -> typing.List[str]:
+        root = self.root / device
+        if not root.exists():
+            return []
+        first, last = self.day_of(start), self.day_of(end)
+        return sorted(d.name for d in root.iterdir() if first <= d.name <= last)
+
+    def _read(self, path: pathlib.Path, typecode: str, begin: int = 0, end: typing.Optional[int] = None):
+        values = array.array(typecode)
+        if not path.exists():
+            return values
+        with open(path, "rb") as fp:
+            fp.seek(begin * values.itemsize)
+            count = (path.stat().st_size // values.itemsize if end is None else end) - begin
+            values.fromfile(fp, max(0, count))
+        return values
+
+    def range(self, device: str, column: str, start: float, end: float):
+        """(times, values) for start <= time < end"""
+        self.flush()
+        times, values = array.array(self.TIME_TYPE), array.array(self.VALUE_TYPE)
+        for day in self.days(device, start, end):
+            path = self.partition(device, day)
+            day_times = self._read(path / f"{self.TIME}.bin", self.TIME_TYPE)
+            lo = bisect.bisect_left(day_times, start)
+            hi = bisect.bisect_left(day_times, end)
+            if lo >= hi:
+                continue
+            times.extend(day_times[lo:hi])
+            values.extend(self._read(path / f"{column}.bin", self.VALUE_TYPE, lo, hi))
+        return times, values
+
+    def aggregate(self, device: str, column: str, start: float, end: float, bucket: float = 0):
+        times, values = self.range(device, column, start, end)
+        if not bucket:
+            bucket = max(end - start, 1)
+        result = []
+        i = 0
+        n = len(times)
+        while i < n:
+            bucket_start = start + (times[i] - start) // bucket * bucket
+            j = bisect.bisect_left(times, bucket_start + bucket, i)
+            chunk = values[i:j]
+            result.append(dict(start=bucket_start, count=len(chunk), min=min(chunk),
+                               max=max(chunk), mean=sum(chunk) / len(chunk)))
+            i = j
+        return result
+
+
+class DeviceState:
+    def __init__(self, name: str, address: str, max_requests: int = 1):
+        self.name = name
+        self.address = address
+        # Proxied requests in flight to the board, an offline one can't take the whole pool
+        self.requests = asyncio.Semaphore(max_requests)
+        self.failures = 0
+        self.last_ok = 0.0
+        self.last_error = ""
+        self.latency = 0.0
+        self.next_poll = 0.0
+        self.latest: typing.Dict[str, int] = {}
+
+    def as_dict(self):
+        return dict(name=self.name, address=self.address, failures=self.failures,
+                    last_ok=self.last_ok, last_error=self.last_error,
+                    latency=self.latency, latest=self.latest)
+
+
+class Collector:
+    """
+    Polls /devicesread of every device concurrently over one pooled HTTP
+    client. Slow or offline devices back off exponentially (with jitter) up
+    to MAX_BACKOFF secs, so they don't hold back the others.
+    """
+    MAX_BACKOFF = 300
+    TIMEOUT = 5.0
+
+    def __init__(self, devices: typing.Mapping[str, str], store: ColumnarStore,
+                 period: float = POLL_PERIOD, max_concurrency: int = 16):
+        self.devices = {name: DeviceState(name, address) for name, address in devices.items()}
+        self.store = store
+        self.period = period
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client: typing.Optional[httpx.AsyncClient] = None
+        self.listeners: typing.List[typing.Callable[[DeviceState], None]] = []
+        self._tasks: typing.List[asyncio.Task] = []
+
+    async def start(self):
+        limits = httpx.Limits(max_connections=self.max_concurrency,
+                              max_keepalive_connections=self.max_concurrency)
+        self.client = httpx.AsyncClient(limits=limits, timeout=self.TIMEOUT)
+        self._tasks = [asyncio.create_task(self.poll_forever(d)) for d in self.devices.values()]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.store.flush()
+        if self.client:
+            await self.client.aclose()
+
+    def backoff(self, device: DeviceState) -> float:
+        delay = min(self.MAX_BACKOFF, self.period * 2 ** device.failures)
+        return delay * random.uniform(0.8, 1.2)
+
+    async def poll(self, device: DeviceState) -> bool:
+        start = time.monotonic()
+        try:
+            async with self.semaphore:
+                resp = await self.client.get(device.address + "/devicesread")
+            resp.raise_for_status()
+            values = resp.json()
+            now = time.time()
+            # Bad readings (eg: null) count as a failed poll instead of ending poll_forever
+            self.store.append(device.name, now, values)
+            device.latency = time.monotonic() - start
+            device.failures = 0
+            device.last_ok = now
+            device.latest = values
+            for listener in self.listeners:
+                listener(device)
+        except Exception as e:
+            device.failures += 1
+            device.last_error = f"{e.__class__.__name__}: {e}"
+            return False
+        return True
+
+    async def poll_forever(self, device: DeviceState):
+        while True:
+            start = time.monotonic()
+            if await self.poll(device):
+                delay = max(0.0, self.period - (time.monotonic() - start))
+            else:
+                delay = self.backoff(device)
+            device.next_poll = time.time() + delay
+            await asyncio.sleep(delay)
+
+
+class CachedResponse(typing.NamedTuple):
+    status: int
+    content_type: str
+    body: bytes
+
+
+class DeviceProxy:
+    """
+    Shields the boards from the dashboards. Concurrent identical GETs share
+    one upstream fetch, and some endpoints are cached for a short TTL (fresh
+    /devicesread samples also come from the collector). POSTs go straight
+    through and invalidate the device's cache. Sample updates are
+    re-broadcast to any number of SSE/WebSocket subscribers.
+    """
+    TTL = {"devicesread": 1.0, "managercfg": 5.0, "logs": 5.0}
+    TIMEOUT = 10.0
+    # The query string is part of the key, so clients choose how many there are
+    MAX_CACHE = 256
+    SUBSCRIBER_QUEUE = 4
+
+    def __init__(self, collector: Collector):
+        self.collector = collector
+        self.client: typing.Optional[httpx.AsyncClient] = None
+        self._cache: typing.Dict[tuple, typing.Tuple[float, CachedResponse]] = {}
+        self._inflight: typing.Dict[tuple, asyncio.Future] = {}
+        self._subscribers: typing.Dict[str, typing.Set[asyncio.Queue]] = {}
+        collector.listeners.append(self.on_sample)
+
+    async def start(self):
+        # Boards serve a single request at a time anyway, DeviceState.requests caps each
+        limits = httpx.Limits(max_connections=max(1, len(self.collector.devices)))
+        self.client = httpx.AsyncClient(timeout=self.TIMEOUT, limits=limits)
+
+    async def stop(self):
+        if self.client:
+            await self.client.aclose()
+
+    def device(self, device: str) -> DeviceState:
+        state = self.collector.devices.get(device)
+        if state is None:
+            raise HTTPException(status_code=404, detail=f"Unknown device {device!r}")
+        return state
+
+    def address(self, device: str) -> str:
+        return self.device(device).address
+
+    async def _fetch(self, method: str, device: str, endpoint: str, query: str, body: bytes = b"") -> CachedResponse:
+        state = self.device(device)
+        url = f"{state.address}/{endpoint}" + (f"?{query}" if query else "")
+        try:
+            await asyncio.wait_for(state.requests.acquire(), self.TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail=f"{device}: busy")
+        try:
+            resp = await self.client.request(method, url, content=body or None,
+                                             headers={"Content-type": "text/plain"})
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"{device}: {e.__class__.__name__}: {e}")
+        finally:
+            state.requests.release()
+        return CachedResponse(resp.status_code, resp.headers.get("content-type", "text/plain"), resp.content)
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2TemplatesCustom(directory="")
+    async def get(self, device: str, endpoint: str, query: str = "") -> CachedResponse:
+        key = (device, endpoint, query)
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._inflight[key] = asyncio.ensure_future(self._fetch("GET", device, endpoint, query))
+            future.add_done_callback(lambda f: self._store(key, f))
+        # shield: a client going away mustn't cancel the fetch others wait for
+        return await asyncio.shield(future)
+
+    def _store(self, key: tuple, future: asyncio.Future):
+        self._inflight.pop(key, None)
+        if future.cancelled() or future.exception():
+            return
+        ttl = self.TTL.get(key[1], 0)
+        if ttl and future.result().status == 200:
+            now = time.monotonic()
+            if len(self._cache) >= self.MAX_CACHE:
+                for k in [k for k, (expires, _) in self._cache.items() if expires <= now]:
+                    del self._cache[k]
+            while len(self._cache) >= self.MAX_CACHE:
+                # Oldest first
+                del self._cache[next(iter(self._cache))]
+            self._cache[key] = (now + ttl, future.result())
+
+    async def post(self, device: str, endpoint: str, query: str, body: bytes) -> CachedResponse:
+        resp = await self._fetch("POST", device, endpoint, query, body)
+        for key in [k for k in self._cache if k[0] == device]:
+            del self._cache[key]
+        return resp
+
+    def on_sample(self, device: DeviceState):
+        body = json.dumps(device.latest).encode()
+        self._cache[(device.name, "devicesread", "")] = (
+            time.monotonic() + self.TTL["devicesread"], CachedResponse(200, "application/json", body))
+        for queue in self._subscribers.get(device.name, ()):
+            if queue.full():
+                # Slow client, drop its oldest update
+                queue.get_nowait()
+            queue.put_nowait(body)
+
+    @contextlib.contextmanager
+    def subscribe(self, device: str):
+        self.address(device)
+        queue = asyncio.Queue(self.SUBSCRIBER_QUEUE)
+        self._subscribers.setdefault(device, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers[device].discard(queue)
+
+
+store = ColumnarStore()
+collector = Collector(parse_devices(os.environ.get("USOLAR_DEVICES", DEFAULT_DEVICES)), store)
+proxy = DeviceProxy(collector)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    await proxy.start()
+    if os.environ.get("USOLAR_COLLECT", "1") != "0":
+        await collector.start()
+    yield
+    await collector.stop()
+    await proxy.stop()
+
+
+class Asset(typing.NamedTuple):
+    mtime: float
+    content_type: str
+    etag: str
+    encodings: typing.Dict[str, bytes]  # "identity", "gzip", "br"
+
+
+def make_asset(body: bytes, content_type: str, mtime: float) -> Asset:
+    encodings = {"identity": body, "gzip": gzip.compress(body, 9, mtime=0)}
+    if brotli:
+        encodings["br"] = brotli.compress(body)
+    etag = 'W/"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+    return Asset(mtime, content_type, etag, encodings)
+
+
+def asset_response(request: Request, asset: Asset, cache_control: str) -> Response:
+    headers = {"ETag": asset.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == asset.etag:
+        return Response(status_code=304, headers=headers)
+    accepted = {part.split(";")[0].strip() for part in request.headers.get("accept-encoding", "").split(",")}
+    for encoding in ("br", "gzip"):
+        if encoding in accepted and encoding in asset.encodings:
+            headers["Content-Encoding"] = encoding
+            return Response(asset.encodings[encoding], media_type=asset.content_type, headers=headers)
+    return Response(asset.encodings["identity"], media_type=asset.content_type, headers=headers)
+
+
+class StaticAssets:
+    """
+    Files under `directory`, read and compressed once, reloaded when their
+    mtime changes. `versioned()` urls carry the content hash so they can be
+    cached forever.
+    """
+    def __init__(self, directory: str, prefix: str = "/static/"):
+        self.directory = pathlib.Path(directory).resolve()
+        self.prefix = prefix
+        self._assets: typing.Dict[str, Asset] = {}
+
+    def get(self, name: str) -> typing.Optional[Asset]:
+        path = (self.directory / name).resolve()
+        if self.directory not in path.parents:
+            return None
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            return None
+        asset = self._assets.get(name)
+        if asset is None or asset.mtime != mtime:
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            asset = self._assets[name] = make_asset(path.read_bytes(), content_type, mtime)
+        return asset
+
+    def versioned(self, match: re.Match) -> str:
+        name = match.group(1)
+        asset = self.get(name)
+        if asset is None:
+            return match.group(0)
+        return f"{self.prefix}{name}?v={asset.etag[3:-1]}"
+
+
+class RenderedPages:
+    """
+    A template rendered once per context, re-rendered when the file changes.
+    Static urls in the page are rewritten to their versioned form.
+    """
+    STATIC_URL = re.compile(r"/static/([\w./-]+)")
+
+    def __init__(self, templates: Jinja2Templates, static: StaticAssets):
+        self.templates = templates
+        self.static = static
+        self._pages: typing.Dict[tuple, Asset] = {}
+
+    def get(self, name: str, **context) -> Asset:
+        template = self.templates.get_template(name)
+        mtime = os.stat(template.filename).st_mtime
+        key = (name,) + tuple(sorted(context.items()))
+        page = self._pages.get(key)
+        if page is None or page.mtime != mtime:
+            # get_template() above already recompiled it if needed
+            body = self.STATIC_URL.sub(self.static.versioned, template.render(**context))
+            page = self._pages[key] = make_asset(body.encode(), "text/html; charset=utf-8", mtime)
+        return page
+
+
+app = FastAPI(lifespan=lifespan)
+
+templates = Jinja2TemplatesCustom(directory=".")
+static = StaticAssets("static")
+pages = RenderedPages(templates, static)
 
 origins = [
     "http://localhost",
@@ -48,8 +553,85 @@ app.add_middleware(
 
 
 @app.get("/", response_class=HTMLResponse)
-async def read_item(request: Request):
-    return templates.TemplateResponse("client.html", {"request":request, "SERVER_ADDRESS": "http://192.168.4.1"})
+async def read_item(request: Request, device: typing.Optional[str] = None):
+    # The page talks to the board through the proxy below
+    device = device or next(iter(collector.devices), "")
+    # Unknown names 404 before rendering, every device caches its own page
+    proxy.address(device)
+    page = pages.get("client.html", SERVER_ADDRESS=f"/device/{device}")
+    return asset_response(request, page, "no-cache")
+
+
+@app.api_route("/static/{name:path}", methods=["GET", "HEAD"])
+async def static_file(request: Request, name: str, v: typing.Optional[str] = None):
+    asset = static.get(name)
+    if asset is None:
+        raise HTTPException(status_code=404)
+    # Versioned urls never change content, others must be revalidated
+    immutable = v is not None and v == asset.etag[3:-1]
+    cache_control = "public, max-age=31536000, immutable" if immutable else "no-cache"
+    return asset_response(request, asset, cache_control)
+
+
+@app.get("/device/{device}/events")
+async def device_events(device: str):
+    """Server-sent events with every /devicesread sample the collector gets"""
+    # 404 before the streaming response starts
+    proxy.address(device)
+
+    async def stream():
+        with proxy.subscribe(device) as queue:
+            while True:
+                body = await queue.get()
+                yield b"data: " + body + b"\n\n"
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.websocket("/device/{device}/ws")
+async def device_websocket(websocket: WebSocket, device: str):
+    await websocket.accept()
+    try:
+        with proxy.subscribe(device) as queue:
+            while True:
+                await websocket.send_bytes(await queue.get())
+    except (WebSocketDisconnect, HTTPException):
+        pass
+
+
+@app.get("/device/{device}/{endpoint}")
+async def device_get(device: str, endpoint: str, request: Request):
+    resp = await proxy.get(device, endpoint, request.url.query)
+    return Response(resp.body, resp.status, media_type=resp.content_type)
+
+
+@app.post("/device/{device}/{endpoint}")
+async def device_post(device: str, endpoint: str, request: Request):
+    resp = await proxy.post(device, endpoint, request.url.query, await request.body())
+    return Response(resp.body, resp.status, media_type=resp.content_type)
+
+
+@app.get("/api/devices")
+async def devices_status():
+    return [d.as_dict() for d in collector.devices.values()]
+
+
+def _check_device(device: str):
+    if device not in collector.devices and not (store.root / device).exists():
+        raise HTTPException(status_code=404, detail=f"Unknown device {device!r}")
+
+
+@app.get("/api/range/{device}/{column}")
+async def samples_range(device: str, column: str, start: float, end: typing.Optional[float] = None):
+    _check_device(device)
+    times, values = store.range(device, column, start, end or time.time())
+    return dict(time=times.tolist(), values=values.tolist())
+
+
+@app.get("/api/aggregate/{device}/{column}")
+async def samples_aggregate(device: str, column: str, start: float,
+                            end: typing.Optional[float] = None, bucket: float = 0):
+    _check_device(device)
+    return store.aggregate(device, column, start, end or time.time(), bucket)
 
 
 if __name__ == '__main__':
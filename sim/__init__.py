@@ -0,0 +1,120 @@
+"""
+Host side simulation of the usolar board, so solar.py, webserver.py and
+main.py run unmodified on CPython.
+
+`install()` puts sim/modules first in sys.path, providing `machine`,
+`network`, `uasyncio`, `utime`, `ujson`, `ustruct`, `uos`, `esp` and `esp32`
+stand-ins, plus the MicroPython only bits of `gc` and `sys`.
+Time is virtual by default: sleeps and asyncio timers advance the clock
+instead of waiting, so days of operation run in seconds.
+
+    python -m sim --days 2
+    python -m sim --realtime --port 8080   # browse http://localhost:8080
+"""
+import builtins
+import gc
+import os
+import pathlib
+import sys
+import time
+import traceback
+
+from sim import hardware
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+MODULES = pathlib.Path(__file__).resolve().parent / 'modules'
+DEFAULTS = pathlib.Path(__file__).resolve().parent / 'defaults'
+DAY = 24 * 60 * 60
+
+
+class VirtualClock:
+    """
+    Seconds since the board epoch (2000-01-01, like an ESP32 without RTC sync).
+    Virtual: only advances when something sleeps. Realtime: follows the wall clock.
+    """
+    def __init__(self, start=0, realtime=False):
+        self.start = start
+        self.now = start
+        self.realtime = realtime
+        self._origin = time.monotonic()
+
+    def time(self):
+        if self.realtime:
+            return self.start + time.monotonic() - self._origin
+        return self.now
+
+    def ticks(self):
+        # Virtual time plus the real time spent computing, so durations
+        # measured with utime.ticks_*() still mean something
+        if self.realtime:
+            return self.time()
+        return self.now + time.perf_counter()
+
+    def advance(self, secs):
+        if secs <= 0:
+            return
+        if self.realtime:
+            time.sleep(secs)
+        else:
+            self.now += secs
+
+
+clock = VirtualClock()
+flash_root = None
+port_map = {}
+_installed = False
+
+
+def flash_path(path):
+    """Map an absolute board path (eg: /client.html) into the simulated flash"""
+    if flash_root is None or not path.startswith('/'):
+        return path
+    return str(flash_root / path.lstrip('/'))
+
+
+def _on_flash(path):
+    if flash_root is None or not isinstance(path, str) or not path.startswith('/'):
+        return False
+    if path.startswith(str(flash_root)):
+        return False
+    top = '/' + path.lstrip('/').split('/', 1)[0]
+    return not os.path.exists(top) or (flash_root / top.lstrip('/')).exists()
+
+
+def board_path(path):
+    """Board paths go to the simulated flash, host absolute paths are left alone"""
+    return flash_path(path) if _on_flash(path) else path
+
+
+_host_open = builtins.open
+
+
+def _board_open(file, *args, **kwargs):
+    return _host_open(board_path(file), *args, **kwargs)
+
+
+def _print_exception(e, file=None):
+    traceback.print_exception(type(e), e, e.__traceback__, file=file)
+
+
+def install(realtime=False, start=0, flash=None, ports=None):
+    """Make the MicroPython modules importable and configure the board"""
+    global flash_root, _installed
+    clock.__init__(start, realtime)
+    flash_root = pathlib.Path(flash).resolve() if flash else None
+    port_map.clear()
+    port_map.update(ports or {})
+    if _installed:
+        return
+    _installed = True
+    for path in (str(MODULES), str(ROOT)):
+        if path in sys.path:
+            sys.path.remove(path)
+    sys.path[:0] = [str(MODULES), str(ROOT)]
+    # config.py is private to each board, fall back to the simulation one
+    sys.path.append(str(DEFAULTS))
+    gc.mem_free = hardware.mem_free
+    gc.mem_alloc = hardware.mem_alloc
+    gc.threshold = hardware.gc_threshold
+    sys.print_exception = _print_exception
+    builtins.open = _board_open
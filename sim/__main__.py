@@ -0,0 +1,95 @@
+"""
+Boot main.py on the simulated board.
+
+    python -m sim --days 3                 # virtual time, as fast as possible
+    python -m sim --realtime --port 8080   # serve client.html on localhost:8080
+    python -m sim --trace export.csv       # replay series from /export.csv
+    python -m sim --days 7 --record week.bin   # then: python -m sim.replay week.bin
+    python -m sim --script bench/bench_log.py
+"""
+import argparse
+import json
+import pathlib
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+
+import sim
+from sim import hardware, traces
+
+
+def make_flash(path=None):
+    """Flash contents like a board after uploading the repo files"""
+    flash = pathlib.Path(path or tempfile.mkdtemp(prefix='usolar-flash-'))
+    flash.mkdir(parents=True, exist_ok=True)
+    shutil.copy(sim.ROOT / 'client.html', flash / 'client.html')
+    shutil.copytree(sim.ROOT / 'static', flash / 'static', dirs_exist_ok=True)
+    return flash
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sim', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=float, default=1, help='simulated days to run (0: forever)')
+    parser.add_argument('--start-hour', type=float, default=0, help='board time of day at boot')
+    parser.add_argument('--realtime', action='store_true', help='follow the wall clock')
+    parser.add_argument('--port', type=int, default=8080, help='host port for the board port 80')
+    parser.add_argument('--flash', help='directory used as the board filesystem')
+    parser.add_argument('--trace', help='/export.csv file to replay instead of a synthetic day')
+    parser.add_argument('--clouds', type=float, default=0.0, help='synthetic cloud cover 0..1')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--disabled', action='store_true', help="don't enable SolarManager")
+    parser.add_argument('--record', metavar='PATH', help='record a trace for `python -m sim.replay`')
+    parser.add_argument('--script', help='run this script on the board instead of main.py')
+    return parser.parse_args(argv)
+
+
+def setup(args):
+    flash = make_flash(args.flash)
+    sim.install(realtime=args.realtime, start=int(args.start_hour * 3600),
+                flash=flash, ports={80: args.port})
+    hardware.reset()
+    if args.trace:
+        traces.load_export_csv(args.trace)
+    else:
+        traces.SolarDay(clouds=args.clouds, seed=args.seed).attach()
+
+
+def run_main(args):
+    import main
+    import uasyncio
+    import solar
+    main.solar_manager.enabled = not args.disabled
+    if args.record:
+        import recorder
+        main.solar_manager.recorder = recorder.TraceRecorder(args.record, max_size=1 << 30)
+    loop = uasyncio.get_event_loop()
+    if args.days:
+        def stop():
+            main.solar_manager.stop = True
+        loop.call_at(sim.clock.start + args.days * sim.DAY, stop)
+    wall = time.perf_counter()
+    main.main()
+    wall = time.perf_counter() - wall
+    simulated = sim.clock.time() - sim.clock.start
+    return dict(simulated_seconds=simulated,
+                wall_seconds=round(wall, 3),
+                speedup=round(simulated / wall, 1) if wall else None,
+                tics=main.solar_manager.tics_count + 1,
+                resistance_switches=len(hardware.writes.get(solar.RESISTANCE_PIN, ())))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup(args)
+    if args.script:
+        sys.argv = [args.script]
+        runpy.run_path(args.script, run_name='__main__')
+        return
+    print(json.dumps(run_main(args)))
+
+
+if __name__ == '__main__':
+    main()
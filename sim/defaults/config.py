@@ -0,0 +1,4 @@
+# Used by the simulation when there is no board config.py
+AP_WIFI_ESSID = 'usolar-sim'
+AP_WIFI_PASSWORD = 'usolar-sim'
+AUTH_TOKEN = 'sim'
@@ -0,0 +1,110 @@
+"""
+Lightweight fake usolar devices for exercising server.py.
+
+Each device answers /devicesread, /managercfg, /logs and POST /resistance
+like the board (same JSON shapes, Connection: close), with readings from
+a SolarDay trace on the wall clock. Some can be slow or offline.
+
+    python -m sim.fakedevice --count 5 --base-port 9100 --latency 0.2 --offline 1
+    USOLAR_DEVICES=d0=http://localhost:9100,d1=http://localhost:9101 python server.py
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from sim.traces import SolarDay
+
+
+class FakeDevice:
+    def __init__(self, name, latency=0.0, offline=False, seed=0):
+        self.name = name
+        self.latency = latency
+        self.offline = offline
+        self.day = SolarDay(clouds=0.3, seed=seed)
+        self.resistance = False
+        self.requests = 0
+        self.server = None
+
+    def devicesread(self):
+        t = time.time()
+        return dict(ac_enabled=bool(not self.day.ac_enabled(t)),
+                    inverter_usb=self.day.inverter_usb(t),
+                    panels=self.day.panels(t),
+                    resistance=self.resistance)
+
+    def route(self, verb, path):
+        if path == '/devicesread':
+            return 'application/json', json.dumps(self.devicesread())
+        if path == '/managercfg':
+            return 'application/json', json.dumps(dict(enabled=True, history_size=20, period_tics=1))
+        if path == '/resistance':
+            if verb == 'POST':
+                self.resistance = not self.resistance
+            return 'application/json', json.dumps(dict(value=self.resistance))
+        if path == '/logs':
+            return 'text/plain', '{}:IMPORTANT: fake device {}\n'.format(int(time.time()), self.name)
+        return None, None
+
+    async def handle(self, reader, writer):
+        self.requests += 1
+        try:
+            if self.offline:
+                # Accept and hang, like an unreachable board behind the AP
+                await asyncio.sleep(3600)
+                return
+            request = await reader.readline()
+            verb, path = request.decode().split()[:2]
+            path = path.split('?', 1)[0]
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            content_type, body = self.route(verb, path)
+            status = '200 OK' if body is not None else '404 NOT FOUND'
+            body = (body or 'Not Found').encode()
+            writer.write('HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n'
+                         'Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n'
+                         .format(status, content_type or 'text/plain', len(body)).encode() + body)
+            await writer.drain()
+        except (ConnectionError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+async def start_devices(count, base_port=0, latency=0.0, offline=0):
+    """Start `count` devices (the last `offline` ones never answer), returns {name: (device, url)}"""
+    devices = {}
+    for i in range(count):
+        device = FakeDevice('d{}'.format(i), latency, i >= count - offline, seed=i)
+        port = await device.start(port=base_port + i if base_port else 0)
+        devices[device.name] = (device, 'http://127.0.0.1:{}'.format(port))
+    return devices
+
+
+async def main(args):
+    devices = await start_devices(args.count, args.base_port, args.latency, args.offline)
+    print('USOLAR_DEVICES=' + ','.join('{}={}'.format(n, url) for n, (_, url) in devices.items()))
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m sim.fakedevice', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=3)
+    parser.add_argument('--base-port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=0.0, help='secs before answering')
+    parser.add_argument('--offline', type=int, default=0, help='how many devices never answer')
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,70 @@
+"""
+State of the simulated board: pin levels, ADC traces and heap.
+
+Inputs are driven by traces, callables receiving the board time in seconds
+and returning the raw value (ADC reading or pin level), see sim.traces.
+"""
+import tracemalloc
+
+HEAP_SIZE = 111 * 1024
+
+# pin id -> raw level (what machine.Pin.value() returns, before any inversion)
+levels = {}
+# pin id -> trace callable, for inputs and ADCs
+traces = {}
+# pin id -> [(time, level), ...] every change written to an output pin
+writes = {}
+# recorded by machine.freq(), machine.lightsleep(), ...
+events = []
+# Sources waking machine.lightsleep(), like the ESP32 RTC:
+#   ext0 (pin id, level), armed by Pin.irq(wake=SLEEP) or esp32.wake_on_ext0()
+#   ext1 ((pin ids), level), armed by esp32.wake_on_ext1()
+wake_sources = dict(ext0=None, ext1=None)
+gc_state = dict(threshold=-1)
+cpu_freq = 160000000
+
+
+def reset():
+    global cpu_freq
+    cpu_freq = 160000000
+    levels.clear()
+    traces.clear()
+    writes.clear()
+    events.clear()
+    wake_sources.update(ext0=None, ext1=None)
+    gc_state['threshold'] = -1
+
+
+def read(pin_id, default=0):
+    from sim import clock
+    return read_at(pin_id, clock.time(), default)
+
+
+def read_at(pin_id, time, default=0):
+    trace = traces.get(pin_id)
+    if trace is not None:
+        return trace(time)
+    return levels.get(pin_id, default)
+
+
+def write(pin_id, level):
+    from sim import clock
+    if levels.get(pin_id) != level:
+        writes.setdefault(pin_id, []).append((clock.time(), level))
+    levels[pin_id] = level
+
+
+def mem_alloc():
+    if tracemalloc.is_tracing():
+        return min(HEAP_SIZE, tracemalloc.get_traced_memory()[0])
+    return HEAP_SIZE // 3
+
+
+def mem_free():
+    return HEAP_SIZE - mem_alloc()
+
+
+def gc_threshold(amount=None):
+    if amount is None:
+        return gc_state['threshold']
+    gc_state['threshold'] = amount
@@ -0,0 +1,13 @@
+# esp32 module stand-in, wake sources live in sim.hardware
+from sim import hardware
+
+WAKEUP_ALL_LOW = False
+WAKEUP_ANY_HIGH = True
+
+
+def wake_on_ext0(pin, level):
+    hardware.wake_sources['ext0'] = None if pin is None else (pin.id, int(level))
+
+
+def wake_on_ext1(pins, level):
+    hardware.wake_sources['ext1'] = (tuple(p.id for p in pins), int(level)) if pins else None
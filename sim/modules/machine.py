@@ -0,0 +1,139 @@
+# machine module stand-in, levels and readings live in sim.hardware
+from sim import clock, hardware
+
+IDLE = 1
+SLEEP = 2
+DEEPSLEEP = 4
+# wake_reason() values
+PIN_WAKE = EXT0_WAKE = 2
+EXT1_WAKE = 3
+TIMER_WAKE = 4
+# Resolution used to look for a wake pin level while sleeping
+WAKE_STEP = 0.05
+
+_wake_reason = 0
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    OPEN_DRAIN = 7
+    PULL_DOWN = 1
+    PULL_UP = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+    WAKE_LOW = 4
+    WAKE_HIGH = 5
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        self.mode = mode
+        self.pull = pull
+        if value is not None:
+            hardware.write(self.id, int(bool(value)))
+        elif self.id not in hardware.levels:
+            # Outputs start low, inputs read high unless pulled down
+            high = mode != self.OUT and pull != self.PULL_DOWN
+            hardware.levels[self.id] = int(high)
+
+    def value(self, v=None):
+        if v is None:
+            return hardware.read(self.id)
+        hardware.write(self.id, int(bool(v)))
+
+    # Like the C implementation, on()/off() don't go through a subclass value()
+    def on(self):
+        hardware.write(self.id, 1)
+
+    def off(self):
+        hardware.write(self.id, 0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, wake=None):
+        hardware.events.append(('irq', clock.time(), self.id, trigger, wake))
+        if wake is not None and wake & SLEEP and trigger in (self.WAKE_LOW, self.WAKE_HIGH):
+            # Like the firmware: a single ext0 pin
+            ext0 = hardware.wake_sources['ext0']
+            if ext0 is not None and ext0[0] != self.id:
+                raise ValueError('no resources')
+            hardware.wake_sources['ext0'] = (self.id, int(trigger == self.WAKE_HIGH))
+
+    def __repr__(self):
+        return 'Pin({})'.format(self.id)
+
+
+class ADC:
+    ATTN_0DB = 0
+    ATTN_2_5DB = 1
+    ATTN_6DB = 2
+    ATTN_11DB = 3
+    WIDTH_12BIT = 3
+
+    def __init__(self, pin, atten=None):
+        self.pin = pin
+        self._atten = atten
+
+    def atten(self, value):
+        self._atten = value
+
+    def width(self, value):
+        pass
+
+    def read(self):
+        return int(hardware.read(self.pin.id))
+
+    def read_u16(self):
+        return self.read() << 4
+
+
+def freq(hz=None):
+    if hz is None:
+        return hardware.cpu_freq
+    hardware.cpu_freq = hz
+    hardware.events.append(('freq', clock.time(), hz))
+
+
+def _woken_by(t):
+    # (wake reason, pin id) of the armed source at its wake level, else None
+    ext0 = hardware.wake_sources['ext0']
+    if ext0 is not None and hardware.read_at(ext0[0], t) == ext0[1]:
+        return EXT0_WAKE, ext0[0]
+    ext1 = hardware.wake_sources['ext1']
+    if ext1 is not None:
+        pin_ids, level = ext1
+        high = [pin_id for pin_id in pin_ids if hardware.read_at(pin_id, t)]
+        # WAKEUP_ANY_HIGH or WAKEUP_ALL_LOW
+        if level and high:
+            return EXT1_WAKE, high[0]
+        if not level and not high:
+            return EXT1_WAKE, pin_ids[0]
+    return None
+
+
+def lightsleep(ms=None):
+    """Advance the clock up to `ms`, or until an armed wake source triggers"""
+    global _wake_reason
+    start = clock.time()
+    end = start + (ms / 1000 if ms is not None else 1 << 30)
+    t = start
+    woken = None
+    while t < end and woken is None:
+        t = min(end, t + WAKE_STEP)
+        woken = _woken_by(t)
+    clock.advance(t - start)
+    _wake_reason, woken_by = woken or (TIMER_WAKE, None)
+    hardware.events.append(('lightsleep', start, ms, t - start, woken_by))
+
+
+def wake_reason():
+    return _wake_reason
+
+
+def reset():
+    raise SystemExit('machine.reset()')
+
+
+def unique_id():
+    return b'usolar'
@@ -0,0 +1,40 @@
+# WLAN stub, only what WifiTracker uses
+STA_IF = 0
+AP_IF = 1
+AUTH_OPEN = 0
+AUTH_WPA_WPA2_PSK = 4
+MODE_11B = 1
+MODE_11G = 2
+MODE_11N = 3
+
+_phy_mode = MODE_11N
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._config = dict(essid='', channel=1)
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = bool(value)
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config[args[0]]
+        self._config.update(kwargs)
+
+    def ifconfig(self):
+        return ('192.168.4.1', '255.255.255.0', '192.168.4.1', '8.8.8.8')
+
+    def isconnected(self):
+        return self._active
+
+
+def phy_mode(mode=None):
+    global _phy_mode
+    if mode is None:
+        return _phy_mode
+    _phy_mode = mode
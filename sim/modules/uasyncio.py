@@ -0,0 +1,126 @@
+# uasyncio on top of asyncio, with the loop time following the simulation clock
+import asyncio as _asyncio
+import selectors as _selectors
+from asyncio import *  # noqa: F401,F403
+from sim import clock, port_map
+
+
+class _ClockSelector(_selectors.DefaultSelector):
+    def select(self, timeout=None):
+        if clock.realtime:
+            return super().select(timeout)
+        events = super().select(0)
+        if not events:
+            if timeout is None:
+                # Only I/O can wake us up
+                events = super().select(None)
+            else:
+                # Jump straight to the next timer
+                clock.advance(timeout)
+        return events
+
+
+class VirtualEventLoop(_asyncio.SelectorEventLoop):
+    def __init__(self):
+        super().__init__(_ClockSelector())
+
+    def time(self):
+        return clock.time()
+
+
+_loop = None
+
+
+def get_event_loop():
+    global _loop
+    if _loop is None or _loop.is_closed():
+        new_event_loop()
+    return _loop
+
+
+def new_event_loop():
+    # Like MicroPython, there is a single loop reused by every run()
+    global _loop
+    _loop = VirtualEventLoop()
+    _asyncio.set_event_loop(_loop)
+    return _loop
+
+
+def run(coro):
+    return get_event_loop().run_until_complete(coro)
+
+
+def sleep_ms(ms):
+    return _asyncio.sleep(ms / 1000)
+
+
+class _StreamReader:
+    def __init__(self, reader):
+        self._reader = reader
+
+    def readline(self):
+        return self._reader.readline()
+
+    async def read(self, n=-1):
+        if n >= 0:
+            return await self._reader.read(n)
+        # MicroPython returns what the request sent, don't wait for EOF
+        data = await self._reader.read(65536)
+        while data and b'\r\n\r\n' not in data and b'\n\n' not in data:
+            more = await self._reader.read(65536)
+            if not more:
+                break
+            data += more
+        length = _content_length(data)
+        end = data.find(b'\r\n\r\n')
+        body = len(data) - end - 4 if end >= 0 else 0
+        while length and body < length:
+            more = await self._reader.read(65536)
+            if not more:
+                break
+            data += more
+            body += len(more)
+        return data
+
+
+def _content_length(data):
+    for line in data.split(b'\r\n'):
+        if line.lower().startswith(b'content-length:'):
+            return int(line.split(b':', 1)[1])
+    return 0
+
+
+class _StreamWriter:
+    def __init__(self, writer):
+        self._writer = writer
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self._writer.write(data)
+
+    def drain(self):
+        return self._writer.drain()
+
+    def close(self):
+        self._writer.close()
+
+    async def wait_closed(self):
+        try:
+            await self._writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    def get_extra_info(self, name, default=None):
+        return self._writer.get_extra_info(name, default)
+
+
+async def start_server(callback, host, port, backlog=5):
+    async def accept(reader, writer):
+        await callback(_StreamReader(reader), _StreamWriter(writer))
+    return await _asyncio.start_server(accept, host, port_map.get(port, port), backlog=backlog)
+
+
+async def open_connection(host, port):
+    reader, writer = await _asyncio.open_connection(host, port)
+    return _StreamReader(reader), _StreamWriter(writer)
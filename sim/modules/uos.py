@@ -0,0 +1,34 @@
+# uos with absolute board paths mapped into the simulated flash
+import os as _os
+from sim import board_path
+
+urandom = _os.urandom
+
+
+def stat(path):
+    return _os.stat(board_path(path))
+
+
+def listdir(path='/'):
+    return _os.listdir(board_path(path))
+
+
+def mkdir(path):
+    _os.mkdir(board_path(path))
+
+
+def remove(path):
+    _os.remove(board_path(path))
+
+
+def rename(old, new):
+    _os.rename(board_path(old), board_path(new))
+
+
+def statvfs(path):
+    st = _os.statvfs(board_path(path))
+    return (st.f_bsize, st.f_frsize, st.f_blocks, st.f_bfree, st.f_bavail,
+            st.f_files, st.f_ffree, st.f_favail, st.f_flag, st.f_namemax)
+
+
+sep = '/'
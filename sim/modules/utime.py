@@ -0,0 +1,59 @@
+# utime on top of the simulation clock (board epoch is 2000-01-01)
+import time as _time
+from sim import clock
+
+EPOCH_OFFSET = 946684800
+
+
+def time():
+    return int(clock.time())
+
+
+def time_ns():
+    return int(clock.time() * 1000000000)
+
+
+def ticks_ms():
+    return int(clock.ticks() * 1000)
+
+
+def ticks_us():
+    return int(clock.ticks() * 1000000)
+
+
+ticks_cpu = ticks_us
+
+
+def ticks_diff(ticks1, ticks2):
+    return ticks1 - ticks2
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def sleep(seconds):
+    clock.advance(seconds)
+
+
+def sleep_ms(ms):
+    clock.advance(ms / 1000)
+
+
+def sleep_us(us):
+    clock.advance(us / 1000000)
+
+
+def gmtime(secs=None):
+    if secs is None:
+        secs = time()
+    t = _time.gmtime(secs + EPOCH_OFFSET)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday)
+
+
+localtime = gmtime
+
+
+def mktime(t):
+    import calendar
+    return calendar.timegm(tuple(t[:6]) + (0, 0, 0)) - EPOCH_OFFSET
@@ -0,0 +1,146 @@
+"""
+Check power.PowerScheduler sleep/wake schedules on the simulated board.
+
+Runs a synthetic day twice (plain uasyncio sleeps, then PowerScheduler) with
+the AP off except between two flash button presses, and a manual AC_ENABLED
+switch at night. Asserts that:
+
+- light sleeps never exceed a tic and never happen with the AP on or within
+  IDLE_AFTER secs of a change,
+- the flash button and AC_ENABLED wake the board when they change,
+- the CPU clock is lowered below PV_10V and restored above it,
+- the resistance decisions are the same as without the scheduler.
+
+    python -m sim.power_check --days 1
+"""
+import argparse
+import json
+import sys
+
+import sim
+from sim import hardware, traces
+
+FLASH_BUTTON_PIN = 0
+# Board times (secs): press the flash button (AP on, then off again),
+# and switch AC_ENABLED by hand for a while
+PRESSES = (3 * 3600 + 0.5, 4 * 3600 + 0.5)
+PRESS_SECS = 2
+AC_SWITCH = (2 * 3600 + 0.3, 2 * 3600 + 120.3)
+
+
+def flash_button(t):
+    # InvertedPin: pressed pulls it low
+    for start in PRESSES:
+        if start <= t < start + PRESS_SECS:
+            return 0
+    return 1
+
+
+def run(days, power_saving):
+    import uasyncio
+    import log
+    import solar
+    import power
+    hardware.reset()
+    day = traces.SolarDay()
+    day.attach()
+
+    def ac_enabled(t):
+        if AC_SWITCH[0] <= t < AC_SWITCH[1]:
+            return 0
+        return day.ac_enabled(t)
+    hardware.traces[traces.AC_ENABLED_PIN] = ac_enabled
+    hardware.traces[FLASH_BUTTON_PIN] = flash_button
+    log.set_levels(log.CRITICAL + 1, log.CRITICAL + 1)
+    manager = solar.SolarManager()
+    manager.enabled = True
+    wifi = solar.WifiTracker('usolar-sim', 'usolar-sim')
+    manager.attach(wifi)
+    if power_saving:
+        manager.scheduler = power.PowerScheduler(manager)
+        manager.services.append(manager.scheduler)
+    # Record the AP state changes
+    ap_changes = []
+    toggle = wifi.toggle
+
+    def logged_toggle():
+        toggle()
+        ap_changes.append((sim.clock.time(), wifi.wifi_active))
+    wifi.toggle = logged_toggle
+
+    loop = uasyncio.get_event_loop()
+
+    def stop():
+        manager.stop = True
+    loop.call_at(sim.clock.start + days * sim.DAY, stop)
+    uasyncio.run(manager.loop_tasks())
+    switches = hardware.writes.get(traces.RESISTANCE_PIN, [])
+    return manager, list(hardware.events), ap_changes, switches
+
+
+def check(days):
+    sim.install()
+    import power
+    _, _, _, baseline = run(days, False)
+    sim.install()
+    manager, events, ap_changes, switches = run(days, True)
+    scheduler = manager.scheduler
+    sleeps = [e for e in events if e[0] == 'lightsleep']
+    freqs = [e for e in events if e[0] == 'freq']
+    failures = []
+
+    def expect(ok, msg):
+        if not ok:
+            failures.append(msg)
+
+    expect(sleeps, 'never light slept')
+    expect(all(ms <= 1000 and slept <= ms / 1000 + 1e-6 for _, _, ms, slept, _ in sleeps),
+           'light sleep longer than a tic')
+    # AP on between the two presses
+    ap_on = [t for t, active in ap_changes if active]
+    ap_off = [t for t, active in ap_changes if not active]
+    expect(len(ap_on) == 1 and len(ap_off) == 1, 'AP toggles {}'.format(ap_changes))
+    if len(ap_on) == 1 and len(ap_off) == 1:
+        expect(not [s for s in sleeps if ap_on[0] <= s[1] < ap_off[0]], 'light slept with the AP on')
+    # Changes: resistance switches, AC switch
+    changes = [t for t, _ in switches] + list(AC_SWITCH)
+    expect(not [s for s in sleeps for c in changes
+                if c < s[1] < c + power.PowerScheduler.IDLE_AFTER - 1],
+           'light slept right after a change')
+    woken = {}
+    for _, start, _, slept, pin in sleeps:
+        if pin is not None:
+            woken.setdefault(pin, []).append(start + slept)
+    for pin, times in ((traces.AC_ENABLED_PIN, AC_SWITCH[:1]), (FLASH_BUTTON_PIN, PRESSES[:1])):
+        for t in times:
+            expect(any(abs(w - t) <= 0.06 for w in woken.get(pin, ())),
+                   'pin {} change at {} did not wake the board'.format(pin, t))
+    expect([hz for _, _, hz in freqs][:2] == [power.NIGHT_FREQ, power.DAY_FREQ],
+           'CPU frequency changes {}'.format(freqs))
+    # Pin wakes can delay the following tics by a few ms, same board seconds though
+    expect([(int(t), v) for t, v in switches] == [(int(t), v) for t, v in baseline],
+           'resistance decisions differ from the plain loop')
+    status = scheduler.status()
+    return dict(ok=not failures,
+                failures=failures,
+                light_sleeps=len(sleeps),
+                pin_wakes={str(k): len(v) for k, v in woken.items()},
+                freq_changes=[(round(t), hz) for _, t, hz in freqs],
+                ap_changes=[(round(t), active) for t, active in ap_changes],
+                resistance_switches=len(switches),
+                status=status)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sim.power_check', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=float, default=1)
+    args = parser.parse_args(argv)
+    report = check(args.days)
+    print(json.dumps(report))
+    if not report['ok']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Replay traces recorded by recorder.TraceRecorder through the trackers.
+
+Feeds every recorded sample to SolarManager.run_tic and the
+InverterTracker/PanelsTracker/ResistanceTracker tics as fast as possible
+(no event loop, no sleeps), and reports the decisions taken, switch
+counts and throughput as JSON. Thresholds can be overridden to tune them:
+
+    python -m sim --days 7 --record /tmp/week.bin
+    python -m sim.replay /tmp/week.bin
+    python -m sim.replay /tmp/week.bin --set PV_10V=100 --set ResistanceTracker.HOLD_DISABLED=300
+"""
+import argparse
+import collections
+import json
+import struct
+import time as _time
+
+import sim
+from sim import hardware, traces
+
+# Must match recorder.py on the board
+MAGIC = b'USTR'
+VERSION = 1
+HEADER = struct.Struct('<4sB')
+RECORD = struct.Struct('<IHHBB')
+COLUMNS = ('time', 'panels', 'inverter_usb', 'ac_enabled', 'resistance')
+
+
+def load_trace(paths):
+    """
+    Columnar trace {column: [values]} from one or more files (oldest first).
+    Times restart at 0 on every boot, and the board starts a new file then:
+    a file starting before the end of the previous one is shifted to follow it.
+    """
+    columns = {name: [] for name in COLUMNS}
+    times = columns['time']
+    for path in paths:
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        magic, version = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path}: unknown trace magic={magic!r} version={version}')
+        end = len(data) - (len(data) - HEADER.size) % RECORD.size
+        offset = None
+        for record in RECORD.iter_unpack(data[HEADER.size:end]):
+            time = record[0]
+            if offset is None:
+                offset = times[-1] + 1 - time if times and time <= times[-1] else 0
+            time += offset
+            if times and time < times[-1]:
+                raise ValueError(f'{path}: time going backwards at record {len(times)}')
+            times.append(time)
+            for name, value in zip(COLUMNS[1:], record[1:]):
+                columns[name].append(value)
+    return columns
+
+
+def apply_overrides(overrides):
+    """`NAME=value` for solar.py constants, `Class.NAME=value` for class attributes"""
+    import solar
+    for item in overrides:
+        name, value = item.split('=', 1)
+        owner = solar
+        if '.' in name:
+            cls, name = name.split('.', 1)
+            owner = getattr(solar, cls)
+        if not hasattr(owner, name):
+            raise AttributeError(f'Unknown parameter {item!r}')
+        setattr(owner, name, type(getattr(owner, name))(float(value)))
+
+
+def build_manager():
+    import log
+    import solar
+    # Only the decisions matter, skip formatting and web log records
+    log.set_levels(log.CRITICAL + 1, log.CRITICAL + 1)
+    manager = solar.SolarManager(None)
+    manager.enabled = True
+    return manager
+
+
+def replay(columns, manager=None):
+    manager = manager or build_manager()
+    resistance_tracker = manager.resistance_tracker
+    inverter_tracker = manager.inverter_tracker
+    runners = (manager,) + manager.trackers
+    levels = hardware.levels
+    decisions = []
+    reasons = collections.Counter()
+    inverter_edges = collections.Counter()
+    agree = 0
+    last_switch = resistance_tracker.switch_time
+    last_edge = None
+    wall = _time.perf_counter()
+    for t, panels, usb, ac, res in zip(*(columns[name] for name in COLUMNS)):
+        levels[traces.PANELS_PIN] = panels
+        levels[traces.INVERTER_USB_PIN] = usb
+        # InvertedPin input, the relay pulls it low
+        levels[traces.AC_ENABLED_PIN] = int(not ac)
+        for r in runners:
+            r.run_tic(t)
+        if resistance_tracker.switch_time != last_switch:
+            last_switch = resistance_tracker.switch_time
+            on = bool(resistance_tracker.is_on())
+            reason = resistance_tracker.status_reason
+            decisions.append((t, on, reason))
+            reasons[reason] += 1
+        detections = inverter_tracker.detections
+        if detections and detections[-1]['time'] != last_edge:
+            last_edge = detections[-1]['time']
+            inverter_edges[detections[-1]['event_type']] += 1
+        agree += bool(resistance_tracker.is_on()) == bool(res)
+    wall = _time.perf_counter() - wall
+    samples = len(columns['time'])
+    return dict(samples=samples,
+                simulated_seconds=columns['time'][-1] - columns['time'][0] if samples else 0,
+                wall_seconds=round(wall, 3),
+                events_per_second=round(samples / wall) if wall else None,
+                resistance_switches=len(decisions),
+                switches_by_reason=dict(reasons),
+                inverter_edges=dict(inverter_edges),
+                agreement_with_recording=round(agree / samples, 4) if samples else None,
+                decisions=decisions)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sim.replay', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('traces', nargs='+', help='trace files, oldest first')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a threshold (repeatable)')
+    parser.add_argument('--no-decisions', action='store_true', help='only report the counters')
+    args = parser.parse_args(argv)
+    sim.install()
+    hardware.reset()
+    columns = load_trace(args.traces)
+    apply_overrides(args.set)
+    report = replay(columns)
+    if args.no_decisions:
+        del report['decisions']
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Vectorized threshold sweep over recorded traces (host only, needs numpy).
+
+Evaluates the InverterTracker edge and oscillation detection and the
+ResistanceTracker state rules of solar.py for every combination of the
+given parameters at once: edges are computed for the whole trace per
+threshold, then the resistance state machine advances one sample at a
+time over arrays holding all the combinations.
+
+    python -m sim.sweep week.bin --grid PV_10V=100,120,140 \\
+        --grid ResistanceTracker.HOLD_DISABLED=120,180,300
+    python -m sim.sweep --fixture --grid PV_12V=400,460,520 --check 3
+
+--check N replays N of the combinations through the scalar trackers
+(sim.replay) and verifies both take the same decisions.
+"""
+import argparse
+import itertools
+import json
+import random
+import time as _time
+
+import numpy as np
+
+import sim
+from sim import hardware, replay, traces
+
+PARAMS = ('INVERTER_USB_THRESHOLD', 'PV_10V', 'PV_12V', 'PV_16V',
+          'InverterTracker.DELTA_MIN', 'InverterTracker.DELTA_MAX',
+          'ResistanceTracker.HOLD_DISABLED', 'ResistanceTracker.HOLD_ENABLED')
+# Decision reasons, in ResistanceTracker naming
+REASONS = ('oscillating', 'sunrise_prevent', 'sunrise', 'highvoltage',
+           'highvoltage_oscillating', 'sunset')
+OSCILLATING, SUNRISE_PREVENT, SUNRISE, HIGHVOLTAGE, HIGHVOLTAGE_OSC, SUNSET = range(len(REASONS))
+NO_EVENT, START, STOP = 0, 1, 2
+
+
+def defaults():
+    import solar
+    values = {}
+    for name in PARAMS:
+        owner = solar
+        attr = name
+        if '.' in name:
+            cls, attr = name.split('.', 1)
+            owner = getattr(solar, cls)
+        values[name] = getattr(owner, attr)
+    return values
+
+
+def expand_grid(grid):
+    """[{param: value}] for the cartesian product of the grid, defaults for the rest"""
+    base = defaults()
+    names = list(grid)
+    combos = []
+    for values in itertools.product(*(grid[n] for n in names)):
+        combo = dict(base)
+        combo.update(zip(names, values))
+        combos.append(combo)
+    return combos
+
+
+def detect_edges(usb, thresholds):
+    """(P, T) START/STOP events, InverterTracker.run_tic for every threshold"""
+    above = usb[None, :] >= thresholds[:, None]
+    edges = np.zeros(above.shape, dtype=np.int8)
+    edges[:, 1:][above[:, 1:] & ~above[:, :-1]] = STOP
+    edges[:, 1:][~above[:, 1:] & above[:, :-1]] = START
+    return edges
+
+
+def evaluate(columns, combos):
+    P = len(combos)
+    col = {name: np.asarray(columns[name], dtype=np.int64) for name in ('time', 'panels', 'inverter_usb')}
+    param = {name: np.array([c[name] for c in combos], dtype=np.int64) for name in PARAMS}
+    threshold = param['INVERTER_USB_THRESHOLD']
+    pv10, pv12, pv16 = param['PV_10V'], param['PV_12V'], param['PV_16V']
+    delta_min = param['InverterTracker.DELTA_MIN']
+    delta_max = param['InverterTracker.DELTA_MAX']
+    hold_disabled = param['ResistanceTracker.HOLD_DISABLED']
+    hold_enabled = param['ResistanceTracker.HOLD_ENABLED']
+    edges = detect_edges(col['inverter_usb'], threshold)
+    # InverterTracker: only the last two detections matter
+    n_det = np.zeros(P, dtype=np.int8)
+    last_type = np.zeros(P, dtype=np.int8)
+    last_time = np.zeros(P, dtype=np.int64)
+    prev_type = np.zeros(P, dtype=np.int8)
+    prev_time = np.zeros(P, dtype=np.int64)
+    # ResistanceTracker
+    res_on = np.zeros(P, dtype=bool)
+    switch_time = np.zeros(P, dtype=np.int64)
+    on_seconds = np.zeros(P, dtype=np.int64)
+    counts = np.zeros((P, len(REASONS)), dtype=np.int64)
+    events = []
+    rows = np.arange(P)
+    times = col['time']
+    for i in range(len(times)):
+        t = times[i]
+        v = col['panels'][i]
+        usb = col['inverter_usb'][i]
+        e = edges[:, i]
+        has = e != NO_EVENT
+        if has.any():
+            prev_type = np.where(has, last_type, prev_type)
+            prev_time = np.where(has, last_time, prev_time)
+            last_type = np.where(has, e, last_type)
+            last_time = np.where(has, t, last_time)
+            n_det = np.minimum(n_det + has, 2)
+        # InverterTracker.is_oscillating(t, switch_time)
+        check_since = np.where(switch_time != 0, switch_time, t - delta_max)
+        delta_events = last_time - prev_time
+        osc = ((n_det >= 2) & (last_type != prev_type) & (last_time >= check_since)
+               & (delta_events <= delta_max)
+               & ~((last_type == STOP) & (delta_events < delta_min)))
+        inverter_on = np.where(n_det > 0, last_type == START, (0 < usb) & (usb < threshold))
+        hold_ok = (switch_time == 0) | (t - switch_time > hold_disabled)
+        off = ~res_on
+        turn_on_osc = off & osc & hold_ok
+        turn_on_prevent = off & ~osc & ~inverter_on & (pv10 < v) & (v < pv12) & hold_ok
+        release_high = res_on & (v > pv12)
+        release_night = res_on & ~release_high & (v < pv10) & (t - switch_time > hold_enabled)
+        switched = turn_on_osc | turn_on_prevent | release_high | release_night
+        if switched.any():
+            reason = np.select(
+                [turn_on_osc, turn_on_prevent, release_high & osc,
+                 release_high & (v > pv16), release_high],
+                [OSCILLATING, SUNRISE_PREVENT, HIGHVOLTAGE_OSC, HIGHVOLTAGE, SUNRISE],
+                SUNSET)
+            idx = rows[switched]
+            counts[idx, reason[idx]] += 1
+            res_on = np.where(switched, turn_on_osc | turn_on_prevent, res_on)
+            switch_time = np.where(switched, t, switch_time)
+            for p in idx:
+                events.append((int(p), int(t), bool(res_on[p]), REASONS[reason[p]]))
+        on_seconds += res_on
+    return dict(counts=counts, on_seconds=on_seconds, events=events)
+
+
+def decisions_of(result, p):
+    return [(t, on, reason) for q, t, on, reason in result['events'] if q == p]
+
+
+def check_equivalence(columns, combos, indexes):
+    """Compare sweep decisions with the scalar trackers for the given combos"""
+    import solar
+    result = evaluate(columns, combos)
+    original = defaults()
+    mismatches = []
+    try:
+        for p in indexes:
+            replay.apply_overrides(f'{k}={v}' for k, v in combos[p].items())
+            hardware.reset()
+            scalar = [tuple(d) for d in replay.replay(columns)['decisions']]
+            if scalar != decisions_of(result, p):
+                mismatches.append(p)
+    finally:
+        replay.apply_overrides(f'{k}={v}' for k, v in original.items())
+    return mismatches
+
+
+def parse_grid(items):
+    grid = {}
+    for item in items:
+        name, values = item.split('=', 1)
+        if name not in PARAMS:
+            raise SystemExit(f'Unknown parameter {name!r}, choose from {", ".join(PARAMS)}')
+        grid[name] = [int(float(v)) for v in values.split(',')]
+    return grid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m sim.sweep', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('traces', nargs='*', help='trace files, oldest first')
+    parser.add_argument('--fixture', action='store_true', help='use the synthetic fixture trace')
+    parser.add_argument('--days', type=float, default=1, help='fixture days')
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=V1,V2,...')
+    parser.add_argument('--check', type=int, default=0, metavar='N',
+                        help='verify N random combinations against the scalar trackers')
+    args = parser.parse_args(argv)
+    sim.install()
+    hardware.reset()
+    columns = traces.fixture_columns(args.days) if args.fixture else replay.load_trace(args.traces)
+    combos = expand_grid(parse_grid(args.grid))
+    wall = _time.perf_counter()
+    result = evaluate(columns, combos)
+    wall = _time.perf_counter() - wall
+    report = dict(samples=len(columns['time']),
+                  combinations=len(combos),
+                  wall_seconds=round(wall, 3),
+                  sample_combinations_per_second=round(len(columns['time']) * len(combos) / wall),
+                  results=[dict(params=combo,
+                                switches=int(result['counts'][p].sum()),
+                                switches_by_reason={r: int(c) for r, c in zip(REASONS, result['counts'][p]) if c},
+                                resistance_on_seconds=int(result['on_seconds'][p]))
+                           for p, combo in enumerate(combos)])
+    if args.check:
+        indexes = random.Random(0).sample(range(len(combos)), min(args.check, len(combos)))
+        report['checked'] = indexes
+        report['mismatches'] = check_equivalence(columns, combos, indexes)
+    print(json.dumps(report))
+    if report.get('mismatches'):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Input traces for the simulated board: callables taking the board time in
+seconds and returning the raw reading of a pin.
+
+SolarDay scripts panels, inverter USB and AC relay from a synthetic
+sunrise/sunset (with the resistance and inverter loading the panels, so
+the inverter oscillates around dawn and dusk). RecordedTrace replays
+series exported by the board with /export.csv.
+"""
+import bisect
+import csv
+import math
+import random
+
+from sim import DAY, hardware
+
+PANELS_PIN = 39
+INVERTER_USB_PIN = 36
+AC_ENABLED_PIN = 12
+RESISTANCE_PIN = 22
+
+INVERTER_USB_ON = 30
+INVERTER_USB_OFF = 1750
+
+
+class SolarDay:
+    # Raw ADC drop on the panels reading caused by each load
+    RESISTANCE_LOAD = 150
+    INVERTER_LOAD = 250
+    # Inverter starts after START_DELAY secs above START_LEVEL,
+    # and stops after STOP_DELAY secs below STOP_LEVEL (PV_13V and PV_12V)
+    START_LEVEL = 630
+    START_DELAY = 10
+    STOP_LEVEL = 460
+    STOP_DELAY = 5
+
+    def __init__(self, sunrise=7, sunset=19, peak=2500, clouds=0.0, seed=0):
+        self.sunrise = sunrise * 3600
+        self.sunset = sunset * 3600
+        self.peak = peak
+        self.clouds = clouds
+        self.seed = seed
+        self.inverter_on = False
+        self.since = 0
+
+    def irradiance(self, t):
+        day_time = t % DAY
+        if not self.sunrise < day_time < self.sunset:
+            return 0
+        phase = (day_time - self.sunrise) / (self.sunset - self.sunrise)
+        level = self.peak * math.sin(math.pi * phase)
+        if self.clouds:
+            # Same cloud cover for every reading within the same 5 minutes
+            rnd = random.Random(self.seed * 1000003 + int(t // 300))
+            level *= 1 - self.clouds * rnd.random()
+        return level
+
+    def resistance_on(self):
+        # InvertedPin: the resistance is on when the pin is low
+        return not hardware.levels.get(RESISTANCE_PIN, 1)
+
+    def panels(self, t):
+        level = self.irradiance(t)
+        if self.resistance_on():
+            level -= self.RESISTANCE_LOAD
+        if self.inverter_on:
+            level -= self.INVERTER_LOAD
+        return max(0, int(level))
+
+    def update_inverter(self, t):
+        level = self.panels(t)
+        if self.inverter_on:
+            if level >= self.STOP_LEVEL:
+                self.since = t
+            elif t - self.since >= self.STOP_DELAY:
+                self.inverter_on = False
+                self.since = t
+        else:
+            if level <= self.START_LEVEL:
+                self.since = t
+            elif t - self.since >= self.START_DELAY:
+                self.inverter_on = True
+                self.since = t
+
+    def inverter_usb(self, t):
+        self.update_inverter(t)
+        return INVERTER_USB_ON if self.inverter_on else INVERTER_USB_OFF
+
+    def ac_enabled(self, t):
+        # Relay pulls the pin low when the inverter AC output is on
+        return 0 if self.inverter_on else 1
+
+    def attach(self):
+        hardware.traces[PANELS_PIN] = self.panels
+        hardware.traces[INVERTER_USB_PIN] = self.inverter_usb
+        hardware.traces[AC_ENABLED_PIN] = self.ac_enabled
+
+
+class RecordedTrace:
+    """Step function over (time, value) samples, times relative to the board start"""
+    def __init__(self, rows, invert=False):
+        rows = sorted(rows)
+        self.times = [t for t, _ in rows]
+        self.values = [int(not v) if invert else v for _, v in rows]
+
+    def __call__(self, t):
+        i = bisect.bisect_right(self.times, t) - 1
+        return self.values[max(i, 0)] if self.values else 0
+
+
+def load_export_csv(path):
+    """Attach the series of a /export.csv download to their pins"""
+    rows = {}
+    with open(path, newline='') as fp:
+        for row in csv.DictReader(fp):
+            rows.setdefault(row['name'], []).append((float(row['time']), int(row['value'])))
+    pins = dict(panels=(PANELS_PIN, False),
+                inverter_usb=(INVERTER_USB_PIN, False),
+                ac_enabled=(AC_ENABLED_PIN, True))
+    for name, (pin, invert) in pins.items():
+        if name in rows:
+            hardware.traces[pin] = RecordedTrace(rows[name], invert)
+    return rows
+
+
+def fixture_columns(days=1, clouds=0.3, seed=0, start=0):
+    """
+    Open loop SolarDay samples (resistance off) in the sim.replay columnar
+    layout, shared by the replay and sweep equivalence checks.
+    """
+    day = SolarDay(clouds=clouds, seed=seed)
+    columns = dict(time=[], panels=[], inverter_usb=[], ac_enabled=[], resistance=[])
+    hardware.levels[RESISTANCE_PIN] = 1
+    for t in range(start, start + int(days * DAY)):
+        usb = day.inverter_usb(t)
+        columns['time'].append(t)
+        columns['panels'].append(day.panels(t))
+        columns['inverter_usb'].append(usb)
+        columns['ac_enabled'].append(int(day.inverter_on))
+        columns['resistance'].append(0)
+    return columns
@@ -1,10 +1,13 @@
+import gc
+import math
 import log
 import uasyncio
 import utime
 import machine
 import devices
+import metrics
 import ujson
-import network
+import uos
 
 LOOP_TIC_SEC = 1
 GC_PERIOD = 10
@@ -49,6 +52,11 @@ class ResistanceTracker(TrackerBase):
     HIGHVOLTAGE_OSC = 'highvoltage_oscillating'
     MANUAL = 'manual'
 
+    # Use InverterTracker.oscillation_score() instead of the last two detections
+    USE_OSCILLATION_SCORE = False
+    OSCILLATION_SCORE_MIN = 0.6
+    OSCILLATION_CONFIDENCE_MIN = 0.5
+
     def __init__(self, manager, panels_tracker, inverter_tracker):
         self.manager = manager
         self.resistance = manager.devices['resistance']
@@ -64,7 +72,7 @@ class ResistanceTracker(TrackerBase):
     def run_tic(self, time):
         if not self.is_on():
             delta = time - self.switch_time
-            if self.inverter_tracker.is_oscillating(time, self.switch_time):
+            if self.is_inverter_oscillating(time):
                 if not self.switch_time or delta > self.HOLD_DISABLED:
                     log.important('Turning resistance on due to oscillations')
                     self.set_switch(True, time, self.OSCILLATING)
@@ -87,7 +95,7 @@ class ResistanceTracker(TrackerBase):
                 if voltage > PV_16V:
                     log.warning('Voltage high even with load...')
                     reason = self.HIGHVOLTAGE
-                if self.inverter_tracker.is_oscillating(time, self.switch_time):
+                if self.is_inverter_oscillating(time):
                     log.warning('Release with high voltage, nevertheless inverter still oscillating')
                     reason = self.HIGHVOLTAGE_OSC
                 log.important('Releasing resistance, there is enough power. reason={}', reason)
@@ -96,6 +104,15 @@ class ResistanceTracker(TrackerBase):
                 log.important('Releasing resistance, seems its night')
                 self.set_switch(False, time, self.SUNSET)
 
+    def is_inverter_oscillating(self, time):
+        if not self.USE_OSCILLATION_SCORE:
+            return self.inverter_tracker.is_oscillating(time, self.switch_time)
+        score, confidence = self.inverter_tracker.oscillation_score()
+        # Like is_oscillating(), only once the inverter changed since our last switch
+        return (score >= self.OSCILLATION_SCORE_MIN
+                and confidence >= self.OSCILLATION_CONFIDENCE_MIN
+                and self.inverter_tracker.last_event_time() >= self.switch_time)
+
     def set_switch(self, status, time, reason):
         if status:
             self.resistance.on()
@@ -103,6 +120,7 @@ class ResistanceTracker(TrackerBase):
             self.resistance.off()
         self.status_reason = reason
         self.switch_time = time
+        self.manager.counters.resistance_switch(reason)
 
     def is_on(self):
         return self.resistance.value()
@@ -122,7 +140,8 @@ class PanelsTracker(TrackerBase):
 
     def voltage_delta(self, min_history=10):
         if not self.manager.enabled or not len(self.manager.history['panels']) >= min_history:
-            log.debug('History log disabled or not enough info...')
+            if log.DEBUG_ENABLED:
+                log.debug('History log disabled or not enough info...')
             return 0
         panels_hist = [v for v,_ in self.manager.history['panels'][-self.sample_size:]]
         negative_count = 0
@@ -141,6 +160,83 @@ class PanelsTracker(TrackerBase):
             return 0
 
 
+# Sliding DFT of the inverter on/off state over the last WINDOW samples, O(1) per
+# sample. score(): share of the AC energy above the k=1 bin (Parseval)
+class OscillationDetector:
+    WINDOW = 240
+    # DFT bins k (period WINDOW/k secs), the score only needs k=1
+    BINS = (1,)
+    # Transitions in the window for a fully confident score
+    MIN_TRANSITIONS = 4
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.twiddles = [(math.cos(2 * math.pi * k / window), math.sin(2 * math.pi * k / window))
+                         for k in self.BINS]
+        self.reset()
+
+    def reset(self):
+        self.samples = bytearray(self.window)
+        self.pos = 0 # oldest sample, next to be replaced
+        self.count = 0
+        self.total = 0
+        self.transitions = 0
+        self.re = [0.0] * len(self.BINS)
+        self.im = [0.0] * len(self.BINS)
+
+    def add(self, x):
+        window = self.window
+        samples = self.samples
+        pos = self.pos
+        old = samples[pos]
+        if self.count:
+            self.transitions += x != samples[(pos - 1) % window]
+        if self.count >= window:
+            self.transitions -= old != samples[(pos + 1) % window]
+        samples[pos] = x
+        self.total += x - old
+        self.pos = (pos + 1) % window
+        self.count += 1
+        if not self.count % window:
+            self.resync()
+            return
+        diff = x - old
+        re = self.re
+        im = self.im
+        for i, (c, s) in enumerate(self.twiddles):
+            r = re[i] + diff
+            re[i] = r * c - im[i] * s
+            im[i] = r * s + im[i] * c
+
+    def resync(self):
+        # X_k = sum(x_age * w^(age + 1)), age 0 being the newest sample
+        window = self.window
+        for i, (c, s) in enumerate(self.twiddles):
+            re = im = 0.0
+            wr, wi = c, s
+            for age in range(window):
+                if self.samples[(self.pos - 1 - age) % window]:
+                    re += wr
+                    im += wi
+                wr, wi = wr * c - wi * s, wr * s + wi * c
+            self.re[i] = re
+            self.im[i] = im
+
+    def power(self, i):
+        return self.re[i] * self.re[i] + self.im[i] * self.im[i]
+
+    def score(self):
+        # (score, confidence) both within 0..1
+        n = self.window
+        ac = n * self.total - self.total * self.total
+        if ac <= 0:
+            return 0.0, 0.0
+        score = max(0.0, min(1.0, (ac - 2 * self.power(0)) / ac))
+        confidence = (min(1.0, self.count / n)
+                      * min(1.0, self.transitions / self.MIN_TRANSITIONS))
+        return score, confidence
+
+
 class InverterTracker(TrackerBase):
     # Deltas between starts and stops
     DELTA_MIN = 2 #seconds
@@ -154,17 +250,21 @@ class InverterTracker(TrackerBase):
         self.manager = manager
         self.detections = []
         self.sample_size = 4
+        self.oscillation = OscillationDetector()
 
     def reset(self):
         self.detections.clear()
+        self.oscillation.reset()
 
     def run_tic(self, time):
         usb_hist = self.manager.history['inverter_usb']
         if len(usb_hist) <= 1:
-            log.debug('No enough information')
+            if log.DEBUG_ENABLED:
+                log.debug('No enough information')
             return
         current, event_time = usb_hist[-1]
         previous, _ = usb_hist[-2]
+        self.oscillation.add(int(current < INVERTER_USB_THRESHOLD))
         event_type = None
         # Note that voltage is inverse: 1.5 when off and 0.5 when on
         if current >= INVERTER_USB_THRESHOLD:
@@ -174,6 +274,7 @@ class InverterTracker(TrackerBase):
         elif previous >= INVERTER_USB_THRESHOLD:
             event_type = self.START_TYPE
         if event_type:
+            self.manager.counters.inverter_event(event_type, time)
             log.important('inverter_usb voltage change.'
                      ' current={}, prev={}, time={}, event_type={}',
                      current, previous, time, event_type)
@@ -189,14 +290,16 @@ class InverterTracker(TrackerBase):
 
     def purge_old(self, detections_size=10):
         if len(self.detections) >= detections_size:
-            log.debug('Purging detections with len={}', len(self.detections))
+            if log.DEBUG_ENABLED:
+                log.debug('Purging detections with len={}', len(self.detections))
             # let's remove a third of the list
             self.detections[:detections_size//3] = []
 
     def is_oscillating(self, time, check_since=None):
         check_since = check_since or time - self.DELTA_MAX
         if len(self.detections) <= 1:
-            log.debug('No enough information')
+            if log.DEBUG_ENABLED:
+                log.debug('No enough information')
             return
         prev1 = self.detections[-1]
         prev2 = self.detections[-2]
@@ -211,7 +314,14 @@ class InverterTracker(TrackerBase):
                     log.error('Something may be wrong, less than {} seconds between events', self.DELTA_MIN)
                     return
                 return True
-        log.debug('Latest event outside scope. Event time={} secs event_type={}', prev1['time'], prev1['event_type'])
+        if log.DEBUG_ENABLED:
+            log.debug('Latest event outside scope. Event time={} secs event_type={}', prev1['time'], prev1['event_type'])
+
+    def oscillation_score(self):
+        return self.oscillation.score()
+
+    def last_event_time(self):
+        return self.detections[-1]['time'] if self.detections else -1
 
     def is_on(self, force_read=False):
         if not force_read and self.manager.enabled and self.detections:
@@ -224,12 +334,174 @@ class InverterTracker(TrackerBase):
             return  0 < value < INVERTER_USB_THRESHOLD
 
 
+# Below memory_threshold free, sheds memory a step at a time (history, web log,
+# bulk endpoints) and tunes gc.threshold(). Undone at twice the threshold
+class MemoryGovernor(TrackerBase):
+    MAX_LEVEL = 3
+    MIN_HISTORY_SIZE = 5
+    MIN_WEB_LOG_SIZE = 5
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.level = 0
+        self.last_sample = 0
+        self.mem_free = 0
+        self.collections = 0
+        self.refused = 0
+        self.gc_threshold = 0
+        self.base_sizes = None
+        self.last_action = ''
+        self.tune_gc()
+
+    def tune_gc(self):
+        # Collect after a fixed amount of allocations (smaller under pressure)
+        start = metrics.ticks()
+        gc.collect()
+        metrics.GC_PAUSE.observe_since(start)
+        self.gc_threshold = gc.mem_free() // (4 << self.level)
+        gc.threshold(self.gc_threshold)
+
+    def run_tic(self, time):
+        if time - self.last_sample < GC_PERIOD:
+            return
+        self.last_sample = time
+        threshold = self.manager.memory_threshold
+        self.mem_free = gc.mem_free()
+        if self.mem_free < threshold:
+            start = metrics.ticks()
+            gc.collect()
+            metrics.GC_PAUSE.observe_since(start)
+            self.collections += 1
+            self.mem_free = gc.mem_free()
+        if self.mem_free < threshold and self.level < self.MAX_LEVEL:
+            self.step_down()
+        elif self.mem_free > threshold * 2 and self.level:
+            self.step_up()
+
+    def step_down(self):
+        manager = self.manager
+        if not self.level:
+            self.base_sizes = (manager.history_size, log.WEB_LOG_SIZE)
+        self.level += 1
+        manager.history_size = max(self.MIN_HISTORY_SIZE, manager.history_size * 2 // 3)
+        for name in manager.history:
+            manager.purge_old(name, manager.history_size)
+        log.set_web_log_size(max(self.MIN_WEB_LOG_SIZE, log.WEB_LOG_SIZE * 2 // 3))
+        self.tune_gc()
+        self.last_action = 'step_down'
+        log.warning('Memory pressure mem_free={} level={} history_size={} web_log_size={}',
+                    self.mem_free, self.level, manager.history_size, log.WEB_LOG_SIZE)
+
+    def step_up(self):
+        self.level -= 1
+        if not self.level:
+            self.manager.history_size, web_log_size = self.base_sizes
+            log.set_web_log_size(web_log_size)
+        self.tune_gc()
+        self.last_action = 'step_up'
+        log.info('Memory recovered mem_free={} level={}', self.mem_free, self.level)
+
+    def allow_bulk(self):
+        if self.level:
+            self.refused += 1
+            return False
+        return True
+
+    def status(self):
+        return dict(level=self.level,
+                    mem_free=self.mem_free,
+                    history_size=self.manager.history_size,
+                    web_log_size=log.WEB_LOG_SIZE,
+                    gc_threshold=self.gc_threshold,
+                    collections=self.collections,
+                    refused=self.refused,
+                    last_action=self.last_action)
+
+
+# Today's on-time per device, resistance switches per reason and inverter
+# starts/stops/oscillation episodes, rolled over at the board clock midnight.
+# Nothing sets the RTC (AP only, no NTP): days start at boot, dated from 2000-01-01
+class DailyCounters(TrackerBase):
+    DAY = 24 * 60 * 60
+    # Don't count gaps (disabled manager, reboots) as on-time: samples
+    # come every period_tics tics, allow a few missed ones
+    MAX_GAP_TICS = 10
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.previous = None
+        self._last_on = {}
+        self._last_time = {}
+        self._last_event = None
+        self.clear(0)
+
+    def clear(self, time):
+        self.date = '{:04}-{:02}-{:02}'.format(*utime.localtime()[:3])
+        self.since = time
+        self.on_seconds = {}
+        self.switches = {}
+        self.inverter_starts = 0
+        self.inverter_stops = 0
+        self.oscillation_episodes = 0
+        self._in_episode = False
+        # Board time of the next local midnight
+        now = utime.localtime()
+        self.next_rollover = time + self.DAY - (now[3] * 3600 + now[4] * 60 + now[5])
+
+    def run_tic(self, time):
+        if time >= self.next_rollover:
+            self.previous = self.summary()
+            log.info('Day summary {}', self.previous)
+            self.clear(time)
+
+    def is_on(self, name, value):
+        if name == 'panels':
+            return value > PV_10V
+        if name == 'inverter_usb':
+            # 0: cable disconnected, like InverterTracker.is_on
+            return 0 < value < INVERTER_USB_THRESHOLD
+        return bool(value)
+
+    def add_sample(self, name, value, time):
+        # The previous state lasted until now
+        last_time = self._last_time.get(name)
+        max_gap = self.MAX_GAP_TICS * self.manager.period_tics * LOOP_TIC_SEC
+        if last_time is not None and self._last_on[name] and 0 < time - last_time <= max_gap:
+            self.on_seconds[name] = self.on_seconds.get(name, 0) + time - last_time
+        self._last_on[name] = self.is_on(name, value)
+        self._last_time[name] = time
+
+    def resistance_switch(self, reason):
+        self.switches[reason] = self.switches.get(reason, 0) + 1
+
+    def inverter_event(self, event_type, time):
+        if event_type == InverterTracker.START_TYPE:
+            self.inverter_starts += 1
+        else:
+            self.inverter_stops += 1
+        if self._last_event is not None and time - self._last_event <= InverterTracker.DELTA_MAX:
+            if not self._in_episode:
+                self.oscillation_episodes += 1
+                self._in_episode = True
+        else:
+            self._in_episode = False
+        self._last_event = time
+
+    def summary(self):
+        return dict(date=self.date,
+                    since=self.since,
+                    on_seconds=self.on_seconds,
+                    resistance_switches=self.switches,
+                    inverter_starts=self.inverter_starts,
+                    inverter_stops=self.inverter_stops,
+                    oscillation_episodes=self.oscillation_episodes)
+
+
 class SolarManager:
     start_time = utime.time()
 
-    def __init__(self, wifi_tracker):
+    def __init__(self, wifi_tracker=None):
         self.init_devices()
-        self.wifi_tracker = wifi_tracker
         self.init_trackers()
         self.history = {n:[] for n in self.devices}
         self.detections = {}
@@ -237,18 +509,51 @@ class SolarManager:
         self.history_size = 20
         self.period_tics = 1
         self.allow_set = set(('enabled', 'history_size', 'period_tics',
-                              'inverter_tracker__detections_size'))
-        self.allow_get = self.allow_set | set(('history',
-                                               'resistance_tracker__status_reason',
+                              'inverter_tracker__detections_size',
+                              'resistance_tracker__USE_OSCILLATION_SCORE'))
+        self.allow_get = self.allow_set | set(('resistance_tracker__status_reason',
                                                'resistance_tracker__is_on',
                                                'inverter_tracker__is_on',
                                                ))
+        # Only sent when asked for, eg: /managercfg?include=history. Also
+        # values changing on every tic, kept out of the version
+        self.allow_get_bulky = set(('history',
+                                    'inverter_tracker__oscillation_score',
+                                    'memory_governor__status',
+                                    ))
+        # get_json() state: bumped every time an allow_get value changes,
+        # boot_id tells versions from a previous boot apart
+        self.version = 0
+        self.boot_id = '{:x}'.format(int.from_bytes(uos.urandom(3), 'little'))
+        self._getters = None
+        self._values = {}
+        self._changed_at = {}
         self.tics_count = -1 # So we start at zero on the first tic
         self.charger_threshold = INVERTER_USB_THRESHOLD
         self.sample_size = 10
         self.save_time = utime.time() - self.start_time
         self.memory_threshold = 30000
         self.stop = False
+        # recorder.TraceRecorder, dumps every collected sample when set
+        self.recorder = None
+        # power.PowerScheduler, sleeps between tics instead of uasyncio when set
+        self.scheduler = None
+        # logfile.FileSink, only for its status
+        self.log_sink = None
+        # Called once, when run_tic collects its first sample (main.py boot timings)
+        self.on_first_sample = None
+        self.memory_governor = MemoryGovernor(self)
+        self.counters = DailyCounters(self)
+        # Extra runners ticked every loop, even when disabled (eg: logfile.FileSink)
+        self.services = [self.memory_governor, self.counters]
+        self.wifi_tracker = None
+        if wifi_tracker:
+            self.attach(wifi_tracker)
+
+    def attach(self, wifi_tracker):
+        # Late, main.py brings the AP up once sampling is running
+        self.wifi_tracker = wifi_tracker
+        self.services.append(wifi_tracker)
 
     def init_devices(self):
         # 10W resistance to load PV when sunrise or sunset
@@ -279,37 +584,58 @@ class SolarManager:
         self.resistance_tracker = resistance_tracker
 
     async def loop_tasks(self):
-        log.garbage_collect()
-        seconds = 0
         #runners = [self] + self.trackers
-        fixed = (self, self.wifi_tracker)
+        fixed = None
+        trackers = self._timed(self.trackers)
         while not self.stop:
+            if fixed is None or len(fixed) != len(self.services) + 1:
+                # Services can be attached while running
+                fixed = self._timed((self,) + tuple(self.services))
+            tic_start = metrics.ticks()
             time = utime.time() - self.start_time
-            for r in fixed:
+            for r, hist in fixed:
+                start = metrics.ticks()
                 r.run_tic(time)
+                hist.observe_since(start)
             if self.enabled:
-                for r in self.trackers:
+                for r, hist in trackers:
+                    start = metrics.ticks()
                     r.run_tic(time)
-            else:
+                    hist.observe_since(start)
+            elif log.DEBUG_ENABLED:
                 log.debug('SolarManager disabled')
-            await uasyncio.sleep(LOOP_TIC_SEC)
-            seconds += LOOP_TIC_SEC
-            if seconds // GC_PERIOD:
-                seconds = seconds % GC_PERIOD
-                log.garbage_collect()
+            metrics.LOOP_TIC.observe_since(tic_start)
+            if self.scheduler:
+                await self.scheduler.sleep(LOOP_TIC_SEC)
+            else:
+                await uasyncio.sleep(LOOP_TIC_SEC)
+
+    def _timed(self, runners):
+        return [(r, metrics.histogram('usolar_run_tic_seconds', 'Duration of each runner run_tic',
+                                      labels='runner="{}"'.format(r.__class__.__name__)))
+                for r in runners]
 
     def run_tic(self, time):
         self.tics_count += 1
         if not self.enabled or self.tics_count % self.period_tics:
-            if not self.enabled:
+            if not self.enabled and log.DEBUG_ENABLED:
                 log.debug('History disabled')
             return
-        log.debug('Collecting devices...')
+        if log.DEBUG_ENABLED:
+            log.debug('Collecting devices...')
+        counters = self.counters
         for name, dev in self.devices.items():
             row = (self._device_value(dev), time)
-            log.debug('{}:{}',name,row)
+            if log.DEBUG_ENABLED:
+                log.debug('{}:{}',name,row)
             self.history[name].append(row)
             self.purge_old(name, self.history_size)
+            counters.add_sample(name, row[0], time)
+        if self.recorder:
+            self.recorder.record(time, self.history)
+        if self.on_first_sample:
+            self.on_first_sample()
+            self.on_first_sample = None
 
     def reset(self):
         for v in self.history.values():
@@ -340,17 +666,58 @@ class SolarManager:
                     obj = getattr(obj, n)
                 setattr(obj, attrs[-1], value)
 
-    def get_json(self):
+    def _getter(self, name):
+        # (object, attribute) for data, (bound method, None) for callables
+        obj = self
+        attrs = name.split('__')
+        for n in attrs[:-1]:
+            obj = getattr(obj, n)
+        value = getattr(obj, attrs[-1])
+        if callable(value):
+            return value, None
+        return obj, attrs[-1]
+
+    def _get(self, getter):
+        obj, attr = getter
+        return obj() if attr is None else getattr(obj, attr)
+
+    def update_version(self):
+        # Names can be added after __init__
+        getters = self._getters
+        if getters is None or len(getters) != len(self.allow_get):
+            getters = self._getters = [(name, self._getter(name)) for name in self.allow_get]
+        values = self._values
+        changed = False
+        for name, getter in getters:
+            value = self._get(getter)
+            if name not in values or values[name] != value:
+                if not changed:
+                    self.version += 1
+                    changed = True
+                values[name] = value
+                self._changed_at[name] = self.version
+        return self.version
+
+    def version_tag(self):
+        return '{}.{}'.format(self.boot_id, self.version)
+
+    def get_json(self, since_version=None, include=()):
+        # Values changed after since_version (a version_tag(), all of them if from another boot)
+        self.update_version()
+        if since_version is not None:
+            boot_id, _, version = since_version.partition('.')
+            since_version = None
+            if boot_id == self.boot_id and version.isdigit() and int(version) <= self.version:
+                since_version = int(version)
+        changed_at = self._changed_at
         json_dict = {}
-        for name in self.allow_get:
-            obj = self
-            attrs = name.split('__')
-            for n in attrs[:-1]:
-                obj = getattr(obj, n)
-            value = getattr(obj, attrs[-1])
-            if callable(value):
-                value = value()
-            json_dict[name] = value
+        for name, value in self._values.items():
+            if since_version is None or changed_at[name] > since_version:
+                json_dict[name] = value
+        for name in include:
+            if name in self.allow_get_bulky:
+                json_dict[name] = self._get(self._getter(name))
+        json_dict['version'] = self.version_tag()
         return json_dict
 
     def get_resistance(self):
@@ -367,7 +734,8 @@ class SolarManager:
         hist_lst = self.history[name]
         length = len(hist_lst)
         if length >= history_size:
-            log.debug('Purging {} with len={}', name, length)
+            if log.DEBUG_ENABLED:
+                log.debug('Purging {} with len={}', name, length)
             # let's remove a third of the list
             hist_lst[:max(history_size//3, length - history_size)] = []
 
@@ -380,6 +748,8 @@ class SolarManager:
 
 class WifiTracker(TrackerBase):
     def __init__(self, essid, password):
+        # Not at module level, so sampling doesn't wait for the network stack
+        import network
         self.light = machine.Pin(LIGHT_PIN, machine.Pin.OUT)
         self.flash_button = devices.InvertedPin(FLASH_BUTTON_PIN, machine.Pin.IN)
         ap = network.WLAN(network.AP_IF)
@@ -430,7 +800,7 @@ class WifiTracker(TrackerBase):
 
 def main():
     log.garbage_collect()
-    log.LOG_LEVEL = log.INFO
+    log.set_levels(log.INFO)
     manager = SolarManager()
     manager.enabled = True
     try:
@@ -0,0 +1,76 @@
+"""
+Strip debug logging from the modules before uploading them to the board.
+
+Removes `log.debug(...)` statements and `if log.DEBUG_ENABLED:` blocks
+(and their `debug(...)`/`if DEBUG_ENABLED:` forms inside log.py), so
+deployed code doesn't even pay for the level check.
+
+    python tools/strip_debug.py --out build *.py
+    mpremote cp -r build/ :
+"""
+import argparse
+import ast
+import pathlib
+
+
+def _is_debug_call(node):
+    if not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Call)):
+        return False
+    func = ast.unparse(node.value.func)
+    return func in ('log.debug', 'debug')
+
+
+def _is_debug_flag(test):
+    return ast.unparse(test) in ('log.DEBUG_ENABLED', 'DEBUG_ENABLED')
+
+
+def _is_debug_guard(node):
+    if not isinstance(node, ast.If) or node.orelse:
+        return False
+    test = node.test
+    if isinstance(test, ast.BoolOp) and isinstance(test.op, ast.And):
+        # `if cond and log.DEBUG_ENABLED:` is never true once stripped
+        return any(_is_debug_flag(v) for v in test.values)
+    return _is_debug_flag(test)
+
+
+class DebugStripper(ast.NodeTransformer):
+    removed = 0
+
+    def generic_visit(self, node):
+        for field in ('body', 'orelse', 'finalbody'):
+            stmts = getattr(node, field, None)
+            if not isinstance(stmts, list) or not stmts or not isinstance(stmts[0], ast.stmt):
+                continue
+            kept = [s for s in stmts if not (_is_debug_call(s) or _is_debug_guard(s))]
+            self.removed += len(stmts) - len(kept)
+            if not kept and field == 'body':
+                kept = [ast.Pass()]
+            setattr(node, field, kept)
+        return super().generic_visit(node)
+
+
+def strip_source(source):
+    stripper = DebugStripper()
+    tree = stripper.visit(ast.parse(source))
+    ast.fix_missing_locations(tree)
+    return ast.unparse(tree) + '\n', stripper.removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='build', help='output directory')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+    out = pathlib.Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    for name in args.files:
+        path = pathlib.Path(name)
+        stripped, removed = strip_source(path.read_text())
+        (out / path.name).write_text(stripped)
+        print(f'{path}: removed {removed} debug statements')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,19 @@ import ujson
 import utime
 import sys
 import log
+import metrics
 
 
 CONN_TIMEOUT=10
 STATUS_CODES = {
     200:'OK',
     302:'FOUND',
+    304:'NOT MODIFIED',
     404:'NOT FOUND',
     403:'FORBIDDEN',
     401:'UNAUTHORIZED',
-    500:'SERVER ERROR'}
+    500:'SERVER ERROR',
+    503:'SERVICE UNAVAILABLE'}
 POST = 'POST'
 GET = 'GET'
 PUT = 'PUT'
@@ -40,6 +43,13 @@ def response(status, content_type, payload, extra_headers=EXTRA_HEADERS):
     yield payload
 
 
+def etag_headers(etag, extra_headers=EXTRA_HEADERS):
+    headers = dict(extra_headers)
+    headers['ETag'] = etag
+    headers['Access-Control-Expose-Headers'] = 'ETag'
+    return headers
+
+
 def redirect(location, status=302):
     yield 'HTTP/1.1 {} {}\n'.format(status, STATUS_CODES[status])
     yield 'Location: {}\n'.format(location)
@@ -49,12 +59,20 @@ class UnauthorizedError(Exception):
     pass
 
 
+class ServiceUnavailableError(Exception):
+    pass
+
+
+class NotModifiedError(Exception):
+    # args[0] is the current ETag
+    pass
+
+
 class StopWebServer(Exception):
     pass
 
 
 def extract_json(payload, auth_token):
-    log.garbage_collect()
     msg = ujson.loads(payload[payload.rfind(b'\r\n\r\n')+4:])
     if msg.get('auth_token') != auth_token:
         raise UnauthorizedError('Unauthorized. Send {"auth_token":"<secret>", "payload": ...}')
@@ -114,30 +132,34 @@ def serve_file(path, replacements=None):
     return yield_chunks(path)
 
 
-def yield_chunks(path):
-    with open(path) as fp:
+def yield_chunks(path, mode='r'):
+    with open(path, mode) as fp:
         chunk = fp.read(CHUNK_SIZE)
         while chunk:
             yield chunk
-            log.garbage_collect()
             chunk = fp.read(CHUNK_SIZE)
 
 
 def yield_lines(path, replacements):
     with open(path) as fp:
         chunk = fp.readline()
-        size = 0
         while chunk:
             for k,v in replacements.items():
                 chunk = chunk.replace(k,v)
             yield chunk
-            size += len(chunk)
-            if size // CHUNK_SIZE:
-                log.garbage_collect()
-                size = 0
             chunk = fp.readline()
 
 
+def request_header(payload, name):
+    # payload holds the request headers (and body), after the request line
+    end = payload.find(b'\r\n\r\n')
+    name = name.lower().encode() + b':'
+    for line in payload[:end if end >= 0 else len(payload)].split(b'\r\n'):
+        if line.lower().startswith(name):
+            return line[len(name):].strip().decode()
+    return None
+
+
 def urldecode_plus(s):
     s = s.replace('+', ' ')
     arr = s.split('%')
@@ -207,18 +229,24 @@ class Server:
                            stream=False,
                            is_async=False,
                            auto_json=True,
-                           auto_json_depth=0):
+                           auto_json_depth=0,
+                           etag=None):
             super().__init__(response_builder=response_builder,
                              extra_headers=extra_headers,
                              stream=stream,
                              is_async=is_async,
                              auto_json=auto_json,
                              auto_json_depth=auto_json_depth,
+                             etag=etag,
                              )
     class html(_endpoint_decorator):
         content_type = 'text/html'
     class plain(_endpoint_decorator):
         content_type = 'text/plain'
+    class csv(_endpoint_decorator):
+        content_type = 'text/csv'
+    class binary(_endpoint_decorator):
+        content_type = 'application/octet-stream'
 
     def _default_method(self, v,req,**params):
         return 'Not Found\n{}\n{}\n{}'.format(v, req, params)
@@ -244,6 +272,7 @@ class Server:
         self.static_path = static_path
         self.static_files_replacements = static_files_replacements
         self.pre_request_hook = pre_request_hook
+        self._http_histograms = {}
         self.default_endpoint = dict(method=self._default_method,
                                      options=dict(
                                          endpoint_type='default',
@@ -253,18 +282,24 @@ class Server:
                                          status=404,
                                      ))
     async def run(self):
-        log.debug('Opening address={host} port={port}.', host=self.host, port=self.port)
+        if log.DEBUG_ENABLED:
+            log.debug('Opening address={host} port={port}.', host=self.host, port=self.port)
         self.conn_id = 0 #connections ids
         self.server = await uasyncio.start_server(self.accept_conn, self.host, self.port, self.backlog)
     async def accept_conn(self, sreader, swriter):
         self.conn_id += 1
         conn_id = self.conn_id
-        log.debug('Accepting conn_id={conn_id}', conn_id=conn_id)
-        log.garbage_collect()
+        start = metrics.ticks()
+        label = 'error'
+        sent = 0
+        if log.DEBUG_ENABLED:
+            log.debug('Accepting conn_id={conn_id}', conn_id=conn_id)
         try:
             verb, path, query_string = await self.read_request_line(sreader, self.timeout)
+            label = self.metrics_label(path)
             payload = await uasyncio.wait_for(sreader.read(-1), self.timeout)
-            log.debug('request={request!r}, conn_id={conn_id}', request=path, conn_id=conn_id)
+            if log.DEBUG_ENABLED:
+                log.debug('request={request!r}, conn_id={conn_id}', request=path, conn_id=conn_id)
             try:
                 if self.static_path and path.startswith(self.static_path) and verb == GET:
                     resp = self.serve_static(path)
@@ -273,24 +308,56 @@ class Server:
                     resp = await self.serve_request(verb, path, params, payload, swriter)
             except UnauthorizedError as e:
                 resp = response(401, 'text/html', web_page('{} {!r}'.format(e,e)))
-            await self.send_response(swriter, resp)
+            except ServiceUnavailableError as e:
+                resp = response(503, 'text/html', web_page('{} {!r}'.format(e,e)))
+            except NotModifiedError as e:
+                resp = response(304, 'text/plain', '', extra_headers=etag_headers(e.args[0]))
+            send_start = metrics.ticks()
+            sent = await self.send_response(swriter, resp)
+            self.http_histograms(label)[1].observe_since(send_start)
         except StopWebServer:
             raise
         except Exception as e:
             msg = 'Exception e={e} e={e!r} conn_id={conn_id}'.format(e=e, conn_id=conn_id)
-            log.debug(msg)
+            if log.DEBUG_ENABLED:
+                log.debug(msg)
             sys.print_exception(e)
             # If we already sent headers, we can't undo things here (but we accept such risk)
-            await self.send_response(swriter, response(500, 'text/html', web_page(msg)))
+            sent += await self.send_response(swriter, response(500, 'text/html', web_page(msg)))
         finally:
             await swriter.drain()
-            log.debug('Disconnect conn_id={conn_id}.', conn_id=conn_id)
+            if log.DEBUG_ENABLED:
+                log.debug('Disconnect conn_id={conn_id}.', conn_id=conn_id)
             swriter.close()
             await swriter.wait_closed()
-            log.debug('Socket closed conn_id={conn_id}.', conn_id=conn_id)
-            log.garbage_collect()
+            if log.DEBUG_ENABLED:
+                log.debug('Socket closed conn_id={conn_id}.', conn_id=conn_id)
+            request_hist, _, bytes_hist = self.http_histograms(label)
+            request_hist.observe_since(start)
+            bytes_hist.observe(sent)
+    def metrics_label(self, path):
+        # Bounded label values: registered endpoints, static files or other
+        if path in _endpoints:
+            return path
+        if self.static_path and path.startswith(self.static_path):
+            return self.static_path
+        return 'other'
+    def http_histograms(self, label):
+        hists = self._http_histograms.get(label)
+        if hists is None:
+            labels = 'path="{}"'.format(label)
+            hists = self._http_histograms[label] = (
+                metrics.histogram('usolar_http_request_seconds',
+                                  'Time from accept to socket closed', labels=labels),
+                metrics.histogram('usolar_http_send_seconds',
+                                  'Time spent in send_response', labels=labels),
+                metrics.histogram('usolar_http_response_bytes',
+                                  'Response size in bytes', metrics.BYTES_BUCKETS, labels, scale=1),
+                )
+        return hists
     async def close(self):
-        log.debug('Closing server.')
+        if log.DEBUG_ENABLED:
+            log.debug('Closing server.')
         self.server.close()
         await self.server.wait_closed()
         log.info('Server closed.')
@@ -333,10 +400,14 @@ class Server:
             resp_payload = await resp_payload
         if options.get('auto_json'):
             resp_payload = self.json_dump(resp_payload, options.get('auto_json_depth', 0))
+        extra_headers = options['extra_headers']
+        if options.get('etag'):
+            # After the method, it may have changed the state
+            extra_headers = etag_headers(options['etag'](), extra_headers)
         response_builder = options['response_builder'] or response
-        return response_builder(options.get('status', 200), options['content_type'], resp_payload, extra_headers=options['extra_headers'])
+        return response_builder(options.get('status', 200), options['content_type'], resp_payload, extra_headers=extra_headers)
     async def send_response(self, swriter, resp):
-        if isinstance(resp, (str, bytes)):
+        if isinstance(resp, (str, bytes, bytearray, memoryview)):
             if resp:
                 swriter.write(resp)
                 return len(resp)
@@ -344,13 +415,16 @@ class Server:
         #elif iscoroutine(resp): # Disabled. We can't distiguish a generator from a coroutine
         #    return await self.send_response(swriter, await resp)
         else:
-            count = 0
+            total = 0
+            pending = 0
             for l in resp:
-                count += await self.send_response(swriter, l)
-                if count // CHUNK_SIZE:
+                sent = await self.send_response(swriter, l)
+                total += sent
+                pending += sent
+                if pending // CHUNK_SIZE:
                     await swriter.drain()
-                    count = 0
-            return count
+                    pending = 0
+            return total
     def json_load(self, payload):
         return extract_json(payload, self.auth_token)
     def json_dump(self, obj, depth=1):
@@ -360,7 +434,7 @@ class Server:
 
 def main():
     app = Server(static_path='/static/')
-    log.LOG_LEVEL = log.DEBUG
+    log.set_levels(log.DEBUG)
     log.garbage_collect()
     try:
         uasyncio.run(app.run())